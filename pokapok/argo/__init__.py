@@ -1,7 +1,10 @@
 """Argo data access."""
 
 __all__ = [
+    'aggregates',
     'data',
+    'index',
+    'sync',
     'types',
     'udal',
 ]
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import numpy
+import xarray
+
+from ..cache import atomic_path
+from ..netcdf import NETCDF_LOCK
+
+
+AGGREGATES_DIR = Path('argo', 'aggregated')
+"""Sub-directory of the cache directory where aggregated datasets are stored."""
+
+PADDING_SUFFIX = '_PADDING'
+"""Suffix of the variables marking the padded cells of character variables
+in stored datasets."""
+
+
+class FileStamp(NamedTuple):
+    """Identity of a source file of an aggregated dataset."""
+
+    path: str
+    mtime_ns: int
+    size: int
+
+    @classmethod
+    def of(cls, path: str | Path) -> 'FileStamp':
+        stat = os.stat(path)
+        return cls(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+class Aggregate(NamedTuple):
+    """Aggregated dataset of a float, with what it was built from."""
+
+    files: list[FileStamp]
+    """Profile files, in aggregation order."""
+    headers: list[dict]
+    """Header of each profile file (see `data.read_header`)."""
+    dataset: xarray.Dataset
+
+
+class AggregateStore():
+    """
+    Aggregated Argo datasets, persisted per float in the cache directory.
+
+    Each entry is keyed by the float and the query options, and records the
+    files it was built from, so callers can tell whether it is still up to
+    date or only needs new cycles appended.
+
+    Datasets are stored as NetCDF. Padded character variables hold Python
+    objects (NaN where padded), so they are written as fixed-width strings,
+    with their padded cells marked in a separate variable. The files and
+    headers an aggregate was built from are written alongside as JSON, with
+    the stamp of the NetCDF file they go with.
+    """
+
+    def __init__(self, cache_dir: str | Path):
+        """
+        Aggregated Argo datasets, persisted per float in the cache directory.
+
+        Args:
+            cache_dir: Cache directory where to store aggregated datasets.
+        """
+        self._dir = Path(cache_dir).joinpath(AGGREGATES_DIR)
+
+    def _file_path(self, dac: str, float: str, options: dict[str, Any]) -> Path:
+        digest = hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()
+        return self._dir.joinpath(dac, float, digest)
+
+    def load(self, dac: str, float: str, options: dict[str, Any]) -> Aggregate | None:
+        """Stored aggregate of a float, if any. Entries that cannot be read
+        back, whatever the reason, are treated as missing."""
+        file_path = self._file_path(dac, float, options)
+        try:
+            with open(file_path.with_suffix('.json')) as file:
+                index = json.load(file, object_hook=_from_json)
+            data_path = file_path.with_suffix('.nc')
+            if FileStamp.of(data_path) != FileStamp(*index['stamp']):
+                return None
+            with NETCDF_LOCK:
+                with xarray.open_dataset(data_path, lock=NETCDF_LOCK) as dataset:
+                    dataset = dataset.load()
+            files = [FileStamp(*stamp) for stamp in index['files']]
+            dataset = _decode(dataset, index['characters'], index['encodings'])
+            return Aggregate(files, index['headers'], dataset)
+        except Exception:
+            return None
+
+    def save(self, dac: str, float: str, options: dict[str, Any], aggregate: Aggregate):
+        """Store the aggregate of a float, replacing any previous one."""
+        file_path = self._file_path(dac, float, options)
+        dataset = aggregate.dataset
+        characters = [name for name, variable in dataset.variables.items() if variable.dtype.kind == 'O']
+        encodings = {name: dict(variable.encoding) for name, variable in dataset.variables.items()}
+        data_path = file_path.with_suffix('.nc')
+        with atomic_path(data_path) as tmp_path, NETCDF_LOCK:
+            _encode(dataset).to_netcdf(tmp_path)
+        index = {
+            'stamp': list(FileStamp.of(data_path)),
+            'files': [list(stamp) for stamp in aggregate.files],
+            'headers': aggregate.headers,
+            'characters': characters,
+            'encodings': encodings,
+        }
+        with atomic_path(file_path.with_suffix('.json')) as tmp_path, open(tmp_path, 'w') as file:
+            json.dump(_to_json(index), file)
+
+
+def _to_json(value: Any) -> Any:
+    """JSON-safe form of headers and encodings, whose NumPy values, dtypes,
+    bytes and tuples are tagged so that `_from_json` restores them."""
+    if isinstance(value, dict):
+        return {str(key): _to_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    if isinstance(value, tuple):
+        return {'__tuple__': [_to_json(item) for item in value]}
+    if isinstance(value, numpy.dtype):
+        return {'__dtype__': value.str}
+    if isinstance(value, (numpy.ndarray, numpy.generic)):
+        array = numpy.asarray(value)
+        if array.dtype.kind in 'mM':
+            array = array.view('i8')
+        return {'__array__': _to_json(array.tolist()), 'dtype': numpy.asarray(value).dtype.str,
+                'scalar': array.ndim == 0}
+    if isinstance(value, bytes):
+        return {'__bytes__': value.decode('latin-1')}
+    return value
+
+
+def _from_json(value: dict) -> Any:
+    """Object hook restoring the values tagged by `_to_json`."""
+    if '__tuple__' in value:
+        return tuple(value['__tuple__'])
+    if '__dtype__' in value:
+        return numpy.dtype(value['__dtype__'])
+    if '__array__' in value:
+        dtype = numpy.dtype(value['dtype'])
+        if dtype.kind in 'mM':
+            array = numpy.array(value['__array__'], dtype='i8').view(dtype)
+        else:
+            array = numpy.array(value['__array__'], dtype=dtype)
+        return array[()] if value['scalar'] else array
+    if '__bytes__' in value:
+        return value['__bytes__'].encode('latin-1')
+    return value
+
+
+def _encode(dataset: xarray.Dataset) -> xarray.Dataset:
+    """Dataset that NetCDF can store: character variables become fixed-width
+    strings, padded cells being marked in a `PADDING_SUFFIX` variable, and
+    encodings are left to the defaults."""
+    variables = {}
+    for name, variable in dataset.variables.items():
+        values = variable.values
+        if variable.dtype.kind == 'O':
+            text = any(isinstance(value, str) for value in values.flat)
+            padded = numpy.array([not isinstance(value, (bytes, str)) for value in values.flat],
+                                 dtype=bool).reshape(values.shape)
+            values = values.copy()
+            values[padded] = '' if text else b''
+            values = values.astype('U' if text else 'S')
+            if padded.any():
+                variables[name + PADDING_SUFFIX] = xarray.Variable(variable.dims, padded)
+        variables[name] = xarray.Variable(variable.dims, values, variable.attrs)
+    return xarray.Dataset(variables, attrs=dataset.attrs).set_coords(list(dataset.coords))
+
+
+def _decode(dataset: xarray.Dataset, characters: list[str], encodings: dict[str, dict]) -> xarray.Dataset:
+    """Stored dataset as it was aggregated (see `_encode`)."""
+    for name in characters:
+        values = dataset[name].values.astype(object)
+        padding = name + PADDING_SUFFIX
+        if padding in dataset.variables:
+            values[dataset[padding].values] = numpy.nan
+            dataset = dataset.drop_vars(padding)
+        dataset[name] = dataset[name].copy(data=values)
+    for name, variable in dataset.variables.items():
+        variable.encoding = encodings.get(name, {})
+    return dataset
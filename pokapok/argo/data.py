@@ -1,11 +1,20 @@
+from collections import Counter, OrderedDict
+import multiprocessing
+import os
 import platform
+import threading
 import warnings
 
 import numpy as np
 import xarray as xr
+from xarray.core import dtypes as xr_dtypes
 import pandas as pd
+import dask
+import dask.array as da
 import dask.bag as db
 
+from ..netcdf import NETCDF_LOCK
+
 
 def _platform_xarray_engine():
     """
@@ -35,66 +44,171 @@ def identify_non_gen_vars(lsls):
         for x in xs
     ]
 
-    dict_count = dict.fromkeys(np.unique(flat_list))
-    for dim in list(dict_count.keys()):
-        dict_count[dim] = flat_list.count(dim)
-
-    iter_count = dict.fromkeys(np.unique(list(dict_count.values())))
-    for v in list(iter_count.keys()):
-        iter_count[v] = (list(dict_count.values()).count(v))
+    dict_count = Counter(flat_list)
+    iter_count = Counter(dict_count.values())
 
     # get the max values
-    max_val = max(iter_count, key=iter_count.get)
+    max_val = max(sorted(iter_count), key=iter_count.get)
 
     # get the differnt keys
-    different_keys = [key for key, value in dict_count.items() if value != max_val]
-
-    # unique unshared dims values
-    uniq_values = list(dict.fromkeys(flat_list))
+    different_keys = [key for key in sorted(dict_count) if dict_count[key] != max_val]
 
     # keys shared by
-    shared_keys = [item for item in uniq_values if item not in different_keys]
+    shared_keys = [item for item in dict_count if item not in different_keys]
 
     return shared_keys, different_keys
 
 
-def get_dims_info(args):
-    """ Get Argo profile Vertical dimension name and size """
-    ds_name, dim_name = args
-    ds = xr.open_dataset(ds_name, engine=_platform_xarray_engine())
-    return dim_name, ds.sizes[dim_name]
-
-
-def dims_info(ds_name):
-    dims = list(dict(xr.open_dataset(ds_name, engine=_platform_xarray_engine()).sizes).keys())
-    return dims
-
-
-def get_dims_max(dss):
+class HeaderCache():
+    """ in-process cache of file headers, keyed by path, modification time
+    and size so a rewritten file is scanned again, and by the filters the
+    header was computed with """
+
+    def __init__(self, maxsize=4096):
+        self._maxsize = maxsize
+        self._headers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ds_name, filters=None):
+        stat = os.stat(ds_name)
+        key = (os.fspath(ds_name), stat.st_mtime_ns, stat.st_size, _filters_key(filters))
+        with self._lock:
+            header = self._headers.get(key)
+            if header is not None:
+                self._headers.move_to_end(key)
+                return header
+        header = filter_header(ds_name, filters) if filters else read_header(ds_name)
+        with self._lock:
+            self._headers[key] = header
+            while len(self._headers) > self._maxsize:
+                self._headers.popitem(last=False)
+        return header
+
+
+class HandleCache():
+    """ in-process cache of open files, so that reading the values of a file
+    whose header was just scanned does not open it again
+
+    handles are keyed by path, modification time and size ; they are only
+    used, and closed, while holding the netCDF lock """
+
+    def __init__(self, maxsize=128):
+        self._maxsize = maxsize
+        self._handles = OrderedDict()
+
+    def open(self, ds_name):
+        """ open dataset of a file, the netCDF lock being held """
+        stat = os.stat(ds_name)
+        path = os.fspath(ds_name)
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self._handles.get(path)
+        if entry is not None:
+            if entry[0] == key:
+                self._handles.move_to_end(path)
+                return entry[1]
+            # rewritten since it was opened
+            self._handles.pop(path)[1].close()
+        ds = xr.open_dataset(ds_name, engine=_platform_xarray_engine(), lock=NETCDF_LOCK)
+        self._handles[path] = (key, ds)
+        while len(self._handles) > self._maxsize:
+            self._handles.popitem(last=False)[1][1].close()
+        return ds
+
+    def close(self, dss=None):
+        """ close the given files, or every file """
+        with NETCDF_LOCK:
+            paths = list(self._handles) if dss is None else [os.fspath(d) for d in dss]
+            for path in paths:
+                entry = self._handles.pop(path, None)
+                if entry is not None:
+                    entry[1].close()
+
+
+HANDLE_CACHE = HandleCache()
+
+
+def read_header(ds_name):
+    """ read all dimension sizes and variable schemas of a file in one pass """
+    with NETCDF_LOCK:
+        ds = HANDLE_CACHE.open(ds_name)
+        return {
+            'sizes': dict(ds.sizes),
+            'attrs': dict(ds.attrs),
+            'variables': {
+                var: {
+                    'dims': ds[var].dims,
+                    'dtype': ds[var].dtype,
+                    'attrs': dict(ds[var].attrs),
+                    'encoding': dict(ds[var].encoding),
+                }
+                for var in ds.data_vars
+            },
+        }
+
+
+HEADER_CACHE = HeaderCache()
+
+
+def scan_header(ds_name, filters=None):
+    """ header of an Argo profile file, from the cache if already scanned
+
+    with filters (see `filter_profiles`), sizes are those of the profiles
+    and levels that are kept """
+    return HEADER_CACHE.get(ds_name, filters)
+
+
+def filter_header(ds_name, filters):
+    """ header of a file once filtered, whose sizes are the numbers of
+    profiles and levels that are kept ; only the variables the filters
+    depend on are read to know them (see `filter_inputs`) """
+    header = scan_header(ds_name)
+    names = filter_inputs(header, filters.get("z_axis", "N_PROF"))
+    values = read_variables((ds_name, names))
+    return filter_profiles(header, values, **filters)[0]
+
+
+FILTER_VARIABLES = ("DATA_MODE", "STATION_PARAMETERS", "PARAMETER_DATA_MODE")
+FILTER_SUFFIXES = ("_QC", "_ADJUSTED", "_ADJUSTED_QC")
+
+
+def filter_inputs(header, z_axis="N_PROF"):
+    """ variables of a file that `filter_profiles` depends on : the data
+    modes, and the float level variables with their QC and adjusted
+    companions, which decide which levels are trimmed """
+    variables = header['variables']
+    names = [var for var in FILTER_VARIABLES if var in variables]
+    for var, info in variables.items():
+        if info['dims'][:2] == (z_axis, LEVEL_DIM) and info['dtype'].kind == "f" \
+                and not var.endswith(FILTER_SUFFIXES):
+            names.append(var)
+            names.extend(var + suffix for suffix in FILTER_SUFFIXES if var + suffix in variables)
+    return names
+
+
+def _filters_key(filters):
+    """ hashable form of filters, for the header cache """
+    return tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                        for name, value in (filters or {}).items()))
+
+
+def get_dims_max(dss, headers=None):
     """ return th max of each dimension size on an argo floats list"""
     # list of dimensions availables
     # TODO : à sortir probablement
     vertical_dim_names = ["N_PROF"]
 
-    # list of each file dimensions
-    bag = db.from_sequence(dss)
-    res = bag.map(dims_info)
-    lsls = res.compute()
+    # one header scan per file gives every dimension size at once
+    if headers is None:
+        headers = scan_headers(dss)
+    lsls = [list(h['sizes'].keys()) for h in headers]
 
     dims_names, undesirable_dimensions = identify_non_gen_vars(lsls)
 
     # on connait maintenant les dimensions partagées par tous les fichiers :
-    # TODO : [IMPROVEMENT] - this loop can be mapped and //
     cnt = 0
     max_sizes = dict.fromkeys(dims_names)
     for dim_name in dims_names :
-        args = list(zip(dss, [dim_name]*len(dss)))
-        bag = db.from_sequence(args)
-        res = bag.map(get_dims_info)
-        names_and_sizes = res.compute()
-        sizes = list(zip(*names_and_sizes))[1]
-
-        max_sizes[dim_name] = max(sizes)
+        max_sizes[dim_name] = max(h['sizes'][dim_name] for h in headers)
 
         # find vertical dimension :
         if dim_name in vertical_dim_names:
@@ -114,96 +228,526 @@ def get_dims_max(dss):
     return max_sizes, z_axis, undesirable_dimensions
 
 
-# -------- EXPAND AND CAT DIMS --------
-
-
-def compute_n_missing_lines(ds, max_n_levels):
-    keys = list(dict(ds.sizes).keys())
-    max_n_levels = np.array(list(max_n_levels.values()))
-    ds_n_levels = np.array(list(dict(ds.sizes).values()))
-
-    diff = max_n_levels-ds_n_levels
+def scan_headers(dss, dask_options=None, filters=None):
+    """ headers of a list of files, scanned in parallel
 
-    return dict(zip(keys, diff))
+    dask_options are passed to compute (scheduler, num_workers) ; header
+    scans are cheap, so there is one partition per worker """
+    dask_options = dask_options or {}
+    n_workers = dask_options.get('num_workers') or os.cpu_count() or 1
+    bag = db.from_sequence(dss, npartitions=max(1, min(len(dss), n_workers)))
+    return bag.map(scan_header, filters=filters).compute(**dask_options)
 
 
-def find_variables_with_dimension(ds, dim_name):
-    """
-    ~~~ Chat GPT function ~~~
-    Find variables in an xarray dataset that are associated with a specific dimension.
-
-    Parameters:
-    ds (xarray.Dataset): The xarray dataset.
-    dim_name (str): The dimension name to check.
+# -------- EXPAND AND CAT DIMS --------
 
-    Returns:
-    list: A list of variable names that have the specified dimension.
-    """
-    variables_with_dim = [var for var in ds.data_vars if dim_name in ds[var].dims]
-    return variables_with_dim
-
-
-def concat_2nd(args):
-    """ on cree un patch de nan qu'on concatene dans toutes le dimensions
-    les unes apres les autreqs pour eviter les erreurs de merge """
-    ds_name, max_n_levels, z_axis, undesirable_dimensions = args
-    # initiate ds and patch ds
-    ds = xr.open_dataset(ds_name, engine=_platform_xarray_engine())
-
-    # remove vars concerned by the undesirable dimensions
-    if undesirable_dimensions != None :
-        for dim in undesirable_dimensions :
-            ds = ds.drop_vars(find_variables_with_dimension(ds, dim), errors='raise')
-
-    # compute number of missing lines
-    nb_missing_lines = compute_n_missing_lines(ds, max_n_levels)
-    # on enleve la dimension sur laquell on va concatener
-    nb_missing_lines[z_axis]=0
-
-    # instanciate a new empty dataset
-    new_ds = xr.Dataset()
-    for dim, dim_size in dict(ds.sizes).items():
-        if nb_missing_lines[dim] == 0 :
-            new_ds[dim] = xr.DataArray(data=np.arange(dim_size), dims=dim)
-        else :
-            new_ds[dim] = xr.DataArray(data=np.arange(max_n_levels[dim]), dims=dim)
-
-    # --- extend dimensions into new_dict ---
-    # TODO : [IMPROVEMENT] - this loop can be mapped and //
-    for var in ds.data_vars:
-        # creating dict for padding
-        if not ds[var].sizes:
-            padding_dict = {z_axis: (0, 1)}
-        else :
-            padding_dict = {}
-            for vardim in ds[var].sizes:
-                padding_dict[vardim] = (0, nb_missing_lines[vardim])
-
-        # pad each variable to match new dataset dimensions
-        new_ds[var] = ds[var].pad(pad_width=padding_dict, constant_values=None)
-
-    # drop initial variables
-    new_ds = new_ds.drop_vars(list(ds.sizes.keys()))
-
-    # copy attributes from old dataset
-    new_ds.attrs = ds.attrs
-
-    return new_ds
-
-
-def combine_ds(dss):
-    """ dss = list f files """
-    max_n_levels, z_axis, undesirable_dimensions = get_dims_max(dss)
 
-    args = list(zip(dss, [max_n_levels]*len(dss), [z_axis]*len(dss), [undesirable_dimensions]*len(dss)))
+LEVEL_DIM = "N_LEVELS"
+OBS_DIM = "N_OBS"
+ROW_SIZE = "ROW_SIZE"
+LAYOUTS = ("dense", "ragged")
+
+
+def plan_variables(headers, z_axis, undesirable_dimensions, layout="dense"):
+    """ union of the variables of all the files, in order of appearance, with
+    their aggregated dimensions and dtype
+
+    Variables without the z axis (e.g. decoded scalar strings) are repeated
+    for every profile of their file. Padding promotes dtypes the same way as
+    `DataArray.pad` (e.g. char arrays become objects to hold NaN).
+
+    In the ragged layout, the (z axis, levels) dimensions of profile
+    variables are flattened into a single observation dimension. """
+    undesirable_dimensions = set(undesirable_dimensions or [])
+    plan = {}
+    for header in headers:
+        for var, info in header['variables'].items():
+            dims = info['dims']
+            if undesirable_dimensions.intersection(dims):
+                continue
+            # scalars are not padded, only broadcast along the z axis
+            dtype = info['dtype'] if not dims else xr_dtypes.maybe_promote(info['dtype'])[0]
+            if var not in plan:
+                if layout == "ragged" and tuple(dims[:2]) == (z_axis, LEVEL_DIM):
+                    out_dims, axis = (OBS_DIM,) + tuple(dims[2:]), OBS_DIM
+                elif z_axis in dims:
+                    out_dims, axis = tuple(dims), z_axis
+                else:
+                    out_dims, axis = (z_axis,) + tuple(dims), z_axis
+                plan[var] = {
+                    'dims': out_dims,
+                    'axis': axis,
+                    'dtypes': [dtype],
+                    'count': 1,
+                    'attrs': info['attrs'],
+                    # only variables that are not padded keep their encoding
+                    'encoding': info['encoding'] if not dims else {},
+                }
+            else:
+                plan[var]['dtypes'].append(dtype)
+                plan[var]['count'] += 1
+
+    for var, spec in plan.items():
+        dtypes = spec.pop('dtypes')
+        if all(d.kind in 'SU' for d in dtypes):
+            # xarray's result_type drops the length of string dtypes
+            dtype = np.result_type(*dtypes)
+        else:
+            dtype = xr_dtypes.result_type(*dtypes)
+        # variables missing from some files are filled in
+        if spec.pop('count') < len(headers):
+            dtype = xr_dtypes.maybe_promote(dtype)[0]
+        spec['dtype'] = dtype
+    return plan
+
+
+def allocate_variables(plan, max_n_levels, n_rows):
+    """ one output array per variable, filled with the padding value
+
+    n_rows gives the length of the aggregation axes (z axis, observations) """
+    arrays = {}
+    for var, spec in plan.items():
+        shape = tuple(n_rows[dim] if dim in n_rows else max_n_levels[dim] for dim in spec['dims'])
+        arrays[var] = empty_variable(shape, spec['dtype'])
+    return arrays
+
+
+def empty_variable(shape, dtype):
+    """ array filled with the padding value of its dtype """
+    if dtype.kind in 'SU':
+        # never padded (see plan_variables)
+        return np.zeros(shape, dtype=dtype)
+    return np.full(shape, xr_dtypes.maybe_promote(dtype)[1], dtype=dtype)
+
+
+def read_variables(args):
+    """ load the variables of a file that are kept in the aggregation
+
+    args is (ds_name, names) or (ds_name, names, filters) ; filters are
+    passed to `filter_profiles`, so that discarded profiles and levels are
+    never padded nor aggregated """
+    ds_name, names, *filters = args
+    filters = filters[0] if filters else None
+    if filters:
+        header = scan_header(ds_name)
+        inputs = filter_inputs(header, filters.get("z_axis", "N_PROF"))
+        values = read_variables((ds_name, list(dict.fromkeys(list(names) + inputs))))
+        values = filter_profiles(header, values, **filters)[1]
+        return {var: values[var] for var in names if var in values}
+    with NETCDF_LOCK:
+        ds = HANDLE_CACHE.open(ds_name)
+        values = {var: ds[var].values for var in names if var in ds.data_vars}
+    if multiprocessing.parent_process() is not None:
+        # in a worker process, nothing closes the cache once the
+        # aggregation is done
+        HANDLE_CACHE.close([ds_name])
+    return values
+
+
+def filter_profiles(header, values, qc_flags=None, data_mode=None,
+                    prefer_adjusted=False, z_axis="N_PROF"):
+    """ profiles of one file kept by the data mode, with their values of
+    rejected QC flags set to NaN, and the header updated accordingly
+
+    data_mode gives the accepted DATA_MODE values (e.g. ["A", "D"]) ;
+    with prefer_adjusted, each parameter X takes the values and flags of
+    X_ADJUSTED for the profiles where X is not in real time, and X_ADJUSTED
+    and X_ADJUSTED_QC are dropped (the mode of X is read from
+    PARAMETER_DATA_MODE when the file has it, from DATA_MODE otherwise) ; qc_flags gives the accepted flags of
+    the X_QC variables (e.g. [1, 2]) ; trailing levels left without any
+    value are then trimmed, so N_LEVELS only spans what is kept """
+    variables = dict(header['variables'])
+    sizes = dict(header['sizes'])
+    values = dict(values)
+
+    def select(rows):
+        for var, data in values.items():
+            dims = variables[var]['dims']
+            if z_axis in dims:
+                values[var] = np.compress(rows, data, axis=dims.index(z_axis))
+        sizes[z_axis] = int(np.count_nonzero(rows))
+
+    def level_variables():
+        return [var for var, data in values.items()
+                if variables[var]['dims'][:2] == (z_axis, LEVEL_DIM) and data.dtype.kind == "f"]
+
+    modes = values.get("DATA_MODE")
+    if modes is not None:
+        modes = np.char.strip(modes.astype(bytes))
+    if data_mode is not None and modes is not None:
+        if isinstance(data_mode, (str, bytes)):
+            data_mode = [data_mode]
+        accepted = np.array([m.encode() if isinstance(m, str) else m for m in data_mode])
+        rows = np.isin(modes, accepted)
+        select(rows)
+        modes = modes[rows]
+
+    if prefer_adjusted:
+        parameters = values.get("STATION_PARAMETERS")
+        parameter_modes = values.get("PARAMETER_DATA_MODE")
+        if parameters is not None and parameter_modes is not None:
+            parameters = char_strings(parameters, variables["STATION_PARAMETERS"]['dims'])
+            parameter_modes = char_strings(parameter_modes, variables["PARAMETER_DATA_MODE"]['dims'])
+            if parameters.shape != parameter_modes.shape or parameters.ndim != 2 or parameters.shape[1] == 0:
+                parameters = parameter_modes = None
+
+        for var in level_variables():
+            adjusted = values.get(f"{var}_ADJUSTED")
+            if adjusted is None:
+                continue
+            if modes is not None:
+                rows = modes != b"R"
+            else:
+                rows = np.isfinite(adjusted).any(axis=tuple(range(1, adjusted.ndim)))
+            if parameter_modes is not None:
+                found = parameters == var.encode()
+                mode = parameter_modes[np.arange(len(found)), found.argmax(axis=1)]
+                rows = np.where(found.any(axis=1), mode != b"R", rows)
+            rows = rows.reshape(rows.shape + (1,) * (adjusted.ndim - 1))
+            values[var] = np.where(rows, adjusted, values[var])
+            if f"{var}_QC" in values and f"{var}_ADJUSTED_QC" in values:
+                values[f"{var}_QC"] = np.where(rows, values[f"{var}_ADJUSTED_QC"], values[f"{var}_QC"])
+            for name in (f"{var}_ADJUSTED", f"{var}_ADJUSTED_QC"):
+                values.pop(name, None)
+                variables.pop(name, None)
+
+    if qc_flags is not None:
+        if isinstance(qc_flags, (int, str, bytes)):
+            qc_flags = [qc_flags]
+        for var in level_variables():
+            flags = values.get(f"{var}_QC")
+            if flags is None:
+                continue
+            accepted = np.array([f if isinstance(f, bytes) else str(f).encode() for f in qc_flags])
+            kept = np.isin(flags.astype(bytes), accepted)
+            kept = kept.reshape(kept.shape + (1,) * (values[var].ndim - kept.ndim))
+            values[var] = np.where(kept, values[var], np.nan)
+
+    if LEVEL_DIM in sizes:
+        # levels are the second axis of level variables, which may have more
+        finite = [np.isfinite(values[var]).any(axis=tuple(i for i in range(values[var].ndim) if i != 1))
+                  for var in level_variables()]
+        if finite:
+            kept = np.logical_or.reduce(finite)
+            n_levels = int(np.flatnonzero(kept)[-1]) + 1 if kept.any() else 0
+            if n_levels < sizes[LEVEL_DIM]:
+                for var, data in values.items():
+                    dims = variables[var]['dims']
+                    if LEVEL_DIM in dims:
+                        values[var] = np.take(data, np.arange(n_levels), axis=dims.index(LEVEL_DIM))
+                sizes[LEVEL_DIM] = n_levels
+
+    return dict(header, sizes=sizes, variables=variables), values
+
+
+def char_strings(data, dims):
+    """ stripped strings of a character variable, whose characters may be
+    along a last STRINGxx dimension (e.g. STATION_PARAMETERS) """
+    data = np.asarray(data).astype(bytes)
+    if dims and dims[-1].startswith("STRING"):
+        n_chars = data.shape[-1]
+        data = np.ascontiguousarray(data.astype("S1")).view(f"S{n_chars}")[..., 0]
+    return np.char.strip(data)
+
+
+def profile_lengths(header, values, z_axis):
+    """ number of levels of each profile of a file, up to its last finite
+    value in any floating point level variable """
+    finite = [np.isfinite(data).any(axis=tuple(range(2, data.ndim)))
+              for var, data in values.items()
+              if header['variables'][var]['dims'][:2] == (z_axis, LEVEL_DIM) and data.dtype.kind == "f"]
+    if not finite:
+        return np.zeros(header['sizes'].get(z_axis, 1), dtype="i8")
+    finite = np.logical_or.reduce(finite)
+    return np.where(finite.any(axis=1), finite.shape[1] - np.argmax(finite[:, ::-1], axis=1), 0)
+
+
+def read_row_sizes(ds_name, z_axis="N_PROF"):
+    """ lengths of the profiles of a file (see `profile_lengths`) """
+    header = scan_header(ds_name)
+    names = [var for var, info in header['variables'].items()
+             if info['dims'][:2] == (z_axis, LEVEL_DIM) and info['dtype'].kind == "f"]
+    return profile_lengths(header, read_variables((ds_name, names)), z_axis)
+
+
+def scan_row_sizes(dss, z_axis, dask_options=None):
+    """ lengths of the profiles of a list of files, read in parallel """
+    dask_options = dask_options or {}
+    n_workers = dask_options.get('num_workers') or os.cpu_count() or 1
+    bag = db.from_sequence(dss, npartitions=max(1, min(len(dss), n_workers)))
+    return bag.map(read_row_sizes, z_axis=z_axis).compute(**dask_options)
+
+
+def fill_variables(arrays, plan, values, starts, lengths, row_sizes=None):
+    """ copy the variables of one file into their slab of the output arrays
+
+    starts and lengths give the position of the file along each
+    aggregation axis (z axis, observations) ; along the observations, only
+    the first row_sizes levels of each profile are packed """
+    for var, data in values.items():
+        spec = plan[var]
+        axis = spec['axis']
+        rows = slice(starts[axis], starts[axis] + lengths[axis])
+        if axis == OBS_DIM:
+            data = data[np.arange(data.shape[1]) < np.asarray(row_sizes)[:, None]]
+            index = (rows,) + tuple(slice(0, size) for size in data.shape[1:])
+        elif len(spec['dims']) == data.ndim:
+            index = tuple(rows if dim == axis else slice(0, size)
+                          for dim, size in zip(spec['dims'], data.shape))
+        else:
+            # repeated along the z axis
+            index = (rows,) + tuple(slice(0, size) for size in data.shape)
+        arrays[var][index] = data
+
+
+def copy_variables(arrays, base):
+    """ copy a previously aggregated dataset into the start of the output
+    arrays, e.g. before appending new cycles """
+    for var, array in arrays.items():
+        if var in base.variables:
+            data = base[var].values
+            array[tuple(slice(0, size) for size in data.shape)] = data
+
+
+def read_block(ds_name, var, spec, shape, length, row_sizes=None):
+    """ slab of one file in an aggregated variable, padded to its shape """
+    block = empty_variable(shape, spec['dtype'])
+    values = read_variables((ds_name, [var]))
+    fill_variables({var: block}, {var: spec}, values, dict.fromkeys(length, 0), length, row_sizes)
+    return block
+
+
+def lazy_variables(dss, plan, max_n_levels, lengths, chunks=None, row_sizes=None):
+    """ dask arrays reading each file's slab of a variable only when it is
+    computed
+
+    chunks maps dimension names to chunk sizes, e.g. {"N_PROF": 256}; by
+    default there is one chunk per file """
+    arrays = {}
+    row_sizes = row_sizes or [None] * len(dss)
+    for var, spec in plan.items():
+        dims = spec['dims']
+        blocks = []
+        for ds_name, length, sizes in zip(dss, lengths, row_sizes):
+            shape = tuple(length[dim] if dim in length else max_n_levels[dim] for dim in dims)
+            block = dask.delayed(read_block, pure=True)(ds_name, var, spec, shape, length, sizes)
+            blocks.append(da.from_delayed(block, shape, dtype=spec['dtype']))
+        array = da.concatenate(blocks, axis=dims.index(spec['axis']))
+        if chunks:
+            array = array.rechunk({dims.index(dim): size for dim, size in chunks.items() if dim in dims})
+        arrays[var] = array
+    return arrays
+
+
+def combine_ds(dss, batch_size=64, layout="dense", lazy=False, chunks=None,
+               dask_options=None, partition_size=8, headers=None, filters=None,
+               base=None, base_files=0):
+    """ dss = list f files
+
+    the output arrays are allocated once, from the file headers, and each
+    file is then copied into its slab along the z axis (or along the
+    observations in the ragged layout)
+
+    if lazy, the variables are dask arrays instead, and files are only
+    read when (and as far as) variables are computed
+
+    dask_options are passed to compute (scheduler, num_workers), and each
+    task reads partition_size files
+
+    headers optionally gives the result of `scan_header` for each file,
+    when files were scanned as they were downloaded ; filters are passed to
+    `filter_profiles` for each file (not with lazy)
+
+    base is a dataset previously aggregated (with the same layout) from the
+    first base_files files : its values are copied instead of reading these
+    files again, only their headers are needed """
+    if layout not in LAYOUTS:
+        raise ValueError(f"unknown layout {layout!r}, expected one of {LAYOUTS}")
+    if lazy and filters:
+        raise ValueError("filters cannot be applied to a lazy aggregation")
+    dask_options = dask_options or {}
+    if headers is None:
+        headers = scan_headers(dss, dask_options, filters)
+    max_n_levels, z_axis, undesirable_dimensions = get_dims_max(dss, headers)
+
+    plan = plan_variables(headers, z_axis, undesirable_dimensions, layout)
+    lengths = [{z_axis: h['sizes'].get(z_axis, 1)} for h in headers]
+    row_sizes = None
+    if layout == "ragged":
+        # only the levels of each profile up to its last value are observations
+        if lazy:
+            row_sizes = scan_row_sizes(dss, z_axis, dask_options)
+        else:
+            # known once files are read, every level counts until then
+            row_sizes = [np.full(length[z_axis], h['sizes'].get(LEVEL_DIM, 0))
+                         for length, h in zip(lengths, headers)]
+            if base is not None and base_files:
+                bounds = np.cumsum([length[z_axis] for length in lengths[:base_files]])[:-1]
+                row_sizes[:base_files] = np.split(base[ROW_SIZE].values, bounds)
+        for length, sizes in zip(lengths, row_sizes):
+            length[OBS_DIM] = int(np.sum(sizes))
+    starts = [{} for _ in headers]
+    n_rows = {}
+    for axis in lengths[0]:
+        offsets = np.cumsum([0] + [length[axis] for length in lengths])
+        for start, offset in zip(starts, offsets):
+            start[axis] = int(offset)
+        n_rows[axis] = int(offsets[-1])
+    if lazy:
+        arrays = lazy_variables(dss, plan, max_n_levels, lengths, chunks, row_sizes)
+    else:
+        arrays = allocate_variables(plan, max_n_levels, n_rows)
+        if base is not None:
+            copy_variables(arrays, base)
+
+        # files are read in batches to bound the memory held by the workers
+        names = list(plan.keys())
+        for b in range(base_files, len(dss), batch_size):
+            bag = db.from_sequence([(ds_name, names, filters) for ds_name in dss[b:b + batch_size]],
+                                   partition_size=partition_size)
+            for i, values in enumerate(bag.map(read_variables).compute(**dask_options), start=b):
+                if row_sizes is not None:
+                    # the observations of each file follow those of the previous one
+                    if i > 0:
+                        starts[i][OBS_DIM] = starts[i - 1][OBS_DIM] + lengths[i - 1][OBS_DIM]
+                    row_sizes[i] = profile_lengths(headers[i], values, z_axis)
+                    lengths[i][OBS_DIM] = int(row_sizes[i].sum())
+                fill_variables(arrays, plan, values, starts[i], lengths[i],
+                               row_sizes[i] if row_sizes is not None else None)
+        if row_sizes is not None:
+            n_obs = starts[-1][OBS_DIM] + lengths[-1][OBS_DIM]
+            for var, spec in plan.items():
+                if spec['axis'] == OBS_DIM:
+                    arrays[var] = arrays[var][:n_obs]
+
+    if not lazy:
+        # every value is read, the files are not needed anymore
+        HANDLE_CACHE.close(dss)
+
+    aggregated_dataset = xr.Dataset(
+        {var: xr.Variable(spec['dims'], arrays[var], spec['attrs'], spec['encoding'])
+         for var, spec in plan.items()},
+        attrs=headers[0]['attrs'])
+
+    if layout == "ragged":
+        row_size = np.concatenate(row_sizes).astype("i8")
+        aggregated_dataset[ROW_SIZE] = xr.Variable(z_axis, row_size, {
+            'long_name': 'number of observations for this profile',
+            'sample_dimension': OBS_DIM,
+        })
+        aggregated_dataset.attrs['featureType'] = 'profile'
 
-    bag = db.from_sequence(args)
-    res = bag.map(concat_2nd)
-    res_computed = res.compute()
+    return aggregated_dataset
 
-    aggregated_dataset = xr.concat(res_computed, dim=z_axis)
 
-    return aggregated_dataset
+# -------- STANDARD LEVELS --------
+
+
+def interpolate_profiles(pres, *values, levels):
+    """ linear interpolation of profiles onto levels, all at once
+
+    pres and values have the levels of each profile along their last axis,
+    padded with NaN and in any order ; the result has the requested levels
+    along its last axis instead, and is NaN outside of each profile's range
+
+    every profile is sorted, then shifted by a per-row offset so that the
+    rows lie one after the other : a single searchsorted on the flattened
+    array then brackets every level of every profile """
+    levels = np.asarray(levels, dtype="f8")
+    shape = pres.shape[:-1]
+    n_levels = pres.shape[-1]
+    pres = np.asarray(pres, dtype="f8").reshape(-1, n_levels)
+    n_rows = pres.shape[0]
+    outputs = [np.full(shape + levels.shape, np.nan,
+                       dtype=v.dtype if v.dtype.kind == "f" else "f8") for v in values]
+    finite = np.isfinite(pres)
+    if n_rows == 0 or n_levels == 0 or not finite.any():
+        return tuple(outputs) if len(outputs) != 1 else outputs[0]
+
+    order = np.argsort(pres, axis=1)  # NaN last
+    pres = np.take_along_axis(pres, order, axis=1)
+    n_valid = np.isfinite(pres).sum(axis=1)[:, None]
+    low = min(np.nanmin(pres), levels.min())
+    span = max(np.nanmax(pres), levels.max()) - low + 1
+    offsets = np.arange(n_rows)[:, None] * span
+    keys = np.where(np.isfinite(pres), pres - low, span - 0.5) + offsets
+    queries = (levels - low)[None, :] + offsets
+    upper = np.searchsorted(keys.ravel(), queries.ravel(), side="right").reshape(n_rows, -1)
+    upper -= np.arange(n_rows)[:, None] * n_levels
+    lower = upper - 1
+
+    lower_index = np.clip(lower, 0, n_levels - 1)
+    upper_index = np.clip(upper, 0, n_levels - 1)
+    pres_lower = np.take_along_axis(pres, lower_index, axis=1)
+    pres_upper = np.take_along_axis(pres, upper_index, axis=1)
+    exact = (lower >= 0) & (lower < n_valid) & (pres_lower == levels)
+    inside = (lower >= 0) & (upper < n_valid)
+    weight = np.divide(levels - pres_lower, pres_upper - pres_lower,
+                       out=np.zeros(inside.shape), where=inside & ~exact)
+
+    for output, data in zip(outputs, values):
+        data = np.take_along_axis(np.asarray(data, dtype="f8").reshape(-1, n_levels), order, axis=1)
+        data_lower = np.take_along_axis(data, lower_index, axis=1)
+        data_upper = np.take_along_axis(data, upper_index, axis=1)
+        result = np.where(exact, data_lower, data_lower + weight * (data_upper - data_lower))
+        output[...] = np.where(exact | inside, result, np.nan).reshape(output.shape)
+    return tuple(outputs) if len(outputs) != 1 else outputs[0]
+
+
+def interpolate_levels(ds, levels, level_variable="PRES"):
+    """ dense dataset with every profile interpolated onto levels of
+    level_variable (e.g. PRES or PRES_ADJUSTED)
+
+    the levels dimension and coordinate are named after level_variable ;
+    the other floating point profile variables are interpolated, and
+    variables along the levels that cannot be (e.g. QC flags) are dropped
+
+    dask arrays stay lazy, each chunk of profiles being interpolated when
+    computed """
+    if OBS_DIM in ds.dims:
+        raise ValueError("only dense datasets can be interpolated onto levels")
+    if level_variable not in ds.variables or LEVEL_DIM not in ds[level_variable].dims:
+        raise ValueError(f"unknown level variable {level_variable!r}")
+    levels = np.asarray(levels, dtype="f8").ravel()
+    pres = ds[level_variable]
+    names = [var for var, array in ds.data_vars.items()
+             if array.dims == pres.dims and array.dtype.kind == "f" and var != level_variable]
+    dropped = [var for var, array in ds.variables.items() if LEVEL_DIM in array.dims]
+
+    interpolated = xr.apply_ufunc(
+        lambda pres, *values: interpolate_profiles(pres, *values, levels=levels),
+        pres, *(ds[var] for var in names),
+        input_core_dims=[[LEVEL_DIM]] * (len(names) + 1),
+        output_core_dims=[[level_variable]] * len(names),
+        dask="parallelized",
+        output_dtypes=[ds[var].dtype for var in names],
+        dask_gufunc_kwargs={"output_sizes": {level_variable: len(levels)}, "allow_rechunk": True},
+        keep_attrs=True)
+    if len(names) == 1:
+        interpolated = (interpolated,)
+    result = ds.drop_vars(dropped).assign({
+        var: array.transpose(*pres.dims[:-1], level_variable) for var, array in zip(names, interpolated)})
+    return result.assign_coords({level_variable: xr.Variable(level_variable, levels, pres.attrs)})
+
+
+# -------- RAGGED ARRAYS ACCESSORS --------
+
+
+def ragged_offsets(ds):
+    """ start of each profile along the observations of a ragged dataset,
+    followed by the total number of observations """
+    return np.concatenate([[0], np.cumsum(ds[ROW_SIZE].values)])
+
+
+def ragged_profile(ds, i, offsets=None):
+    """ profile i of a ragged dataset, as views on the aggregated arrays
+
+    pass the result of `ragged_offsets` as offsets when extracting many
+    profiles """
+    if offsets is None:
+        offsets = ragged_offsets(ds)
+    z_axis = ds[ROW_SIZE].dims[0]
+    return ds.isel({z_axis: i, OBS_DIM: slice(int(offsets[i]), int(offsets[i + 1]))})
 
 
 def extract_meta(dss):
@@ -218,7 +762,8 @@ def extract_meta(dss):
 def include_meta(meta_file, aggregated_dataset):
     """ adding additional information only present in the meta file """
     if meta_file:
-        ds_meta = xr.open_dataset(meta_file, engine=_platform_xarray_engine())
+        with NETCDF_LOCK:
+            ds_meta = xr.open_dataset(meta_file, engine=_platform_xarray_engine(), lock=NETCDF_LOCK).load()
         try:
             launch_date = np.array([ds_meta["LAUNCH_DATE"].astype(str).data])[0].strip()
             aggregated_dataset.attrs["launch_date"] = str(pd.to_datetime(launch_date, format='%Y%m%d%H%M%S'))
@@ -236,14 +781,18 @@ def include_meta(meta_file, aggregated_dataset):
         return aggregated_dataset
 
 
-def cat_datasets(args):
+def cat_datasets(args, layout="dense", lazy=False, chunks=None,
+                 dask_options=None, partition_size=8, headers=None, filters=None,
+                 base=None, base_files=0):
     # starting by extracting meta files and list of files
     meta_file, dss = extract_meta(*args)
 
     # si le fichier meta existe on l'inclus
     # if meta_file:
     # CASE : ARGO FILES TYPE
-    aggregated_dataset = combine_ds(dss)
+    aggregated_dataset = combine_ds(dss, layout=layout, lazy=lazy, chunks=chunks,
+                                    dask_options=dask_options, partition_size=partition_size,
+                                    headers=headers, filters=filters, base=base, base_files=base_files)
     aggregated_dataset = include_meta(meta_file, aggregated_dataset)
 
     return aggregated_dataset
@@ -0,0 +1,184 @@
+import gzip
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas
+
+from .types import FloatType
+
+
+META_INDEX_FILENAME = 'ar_index_global_meta.txt.gz'
+"""GDAC index of the metadata files, one line per float."""
+
+
+def read_dac_index(path: str | Path) -> dict[str, str]:
+    """
+    Read the DAC of each float from a GDAC metadata index file.
+
+    The index lists one `<dac>/<float>/<float>_meta.nc` file per line, after
+    comment lines starting with `#` and a CSV header.
+
+    Args:
+        path: Path to the (gzipped) metadata index file.
+
+    Returns:
+        A dictionary mapping float identifiers to their DAC.
+    """
+    dacs = {}
+    with gzip.open(path, 'rt', encoding='utf-8', errors='replace') as index:
+        for line in index:
+            if line.startswith('#') or line.startswith('file,'):
+                continue
+            parts = line.split(',', 1)[0].split('/')
+            if len(parts) >= 2:
+                dacs[parts[1]] = parts[0]
+    return dacs
+
+
+PROFILE_INDEX_FILENAMES = {
+    FloatType.CORE: 'ar_index_global_prof.txt.gz',
+    FloatType.BGC: 'argo_bio-profile_index.txt.gz',
+    FloatType.SYNTHETIC: 'argo_synthetic-profile_index.txt.gz',
+}
+"""GDAC index of the profile files, one line per profile, for each float type."""
+
+
+class ProfileIndex():
+    """
+    GDAC profile index loaded into columns.
+
+    Filters are vectorized over the whole index, so selecting profiles by
+    region, time, DAC, float or data mode does not need any request.
+    """
+
+    def __init__(self, path: str | Path, float_type: FloatType = FloatType.CORE):
+        """
+        GDAC profile index loaded into columns.
+
+        Args:
+            path: Path to the (gzipped) profile index file.
+            float_type: Type of the floats listed in the index.
+        """
+        index = pandas.read_csv(
+            path,
+            comment='#',
+            usecols=['file', 'date', 'latitude', 'longitude', 'institution', 'profiler_type'],
+            dtype={'file': str, 'date': str, 'institution': 'category'})
+        parts = index['file'].str.extract(r'^([^/]+)/([^/]+)/(?:profiles/)?[BS]?([RD])[^_]*_([0-9]+)(D?)\.nc$')
+        self._float_type = float_type
+        self._file = index['file'].to_numpy()
+        self._dac = _Categories(parts[0])
+        self._float = _Categories(parts[1])
+        self._mode = parts[2].to_numpy()
+        self._cycle = pandas.to_numeric(parts[3]).to_numpy()
+        self._descending = (parts[4] == 'D').to_numpy()
+        self._date = pandas.to_datetime(index['date'], format='%Y%m%d%H%M%S', errors='coerce').to_numpy()
+        self._latitude = index['latitude'].to_numpy(dtype=np.float64)
+        self._longitude = index['longitude'].to_numpy(dtype=np.float64)
+        self._institution = _Categories(index['institution'])
+        self._profiler_type = index['profiler_type'].to_numpy()
+
+    def __len__(self) -> int:
+        return len(self._file)
+
+    @property
+    def float_type(self) -> FloatType:
+        return self._float_type
+
+    def select(self,
+            lon_min: float | None = None,
+            lon_max: float | None = None,
+            lat_min: float | None = None,
+            lat_max: float | None = None,
+            time_min: Any = None,
+            time_max: Any = None,
+            dac: str | list[str] | None = None,
+            float: str | list[str] | None = None,
+            float_mode: list[str] | None = None,
+            descending_cycles: bool = True) -> pandas.DataFrame:
+        """
+        Select profiles from the index.
+
+        Longitude bounds wrap around the antimeridian when `lon_min` is
+        greater than `lon_max`. Time bounds are anything `pandas.Timestamp`
+        accepts.
+
+        Args:
+            lon_min: Minimum longitude.
+            lon_max: Maximum longitude.
+            lat_min: Minimum latitude.
+            lat_max: Maximum latitude.
+            time_min: Minimum profile date.
+            time_max: Maximum profile date.
+            dac: DAC name(s).
+            float: Float identifier(s).
+            float_mode: Data mode letter(s) in the file names (`R`, `D`).
+            descending_cycles: Whether to include descending profiles.
+
+        Returns:
+            One row per profile, with its path relative to the GDAC `dac`
+            directory, in index order.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if lon_min is not None and lon_max is not None and lon_min > lon_max:
+            mask &= (self._longitude >= lon_min) | (self._longitude <= lon_max)
+        else:
+            if lon_min is not None:
+                mask &= self._longitude >= lon_min
+            if lon_max is not None:
+                mask &= self._longitude <= lon_max
+        if lat_min is not None:
+            mask &= self._latitude >= lat_min
+        if lat_max is not None:
+            mask &= self._latitude <= lat_max
+        if time_min is not None:
+            mask &= self._date >= pandas.Timestamp(time_min).to_datetime64()
+        if time_max is not None:
+            mask &= self._date <= pandas.Timestamp(time_max).to_datetime64()
+        if dac is not None:
+            mask &= self._dac.isin(_as_list(dac))
+        if float is not None:
+            mask &= self._float.isin(_as_list(float))
+        if float_mode is not None:
+            mask &= np.isin(self._mode, float_mode)
+        if not descending_cycles:
+            mask &= ~self._descending
+
+        rows = np.flatnonzero(mask)
+        return pandas.DataFrame({
+            'file': self._file[rows],
+            'dac': self._dac.take(rows),
+            'float': self._float.take(rows),
+            'cycle': self._cycle[rows],
+            'descending': self._descending[rows],
+            'float_mode': self._mode[rows],
+            'float_type': self._float_type.name,
+            'date': self._date[rows],
+            'latitude': self._latitude[rows],
+            'longitude': self._longitude[rows],
+            'institution': self._institution.take(rows),
+            'profiler_type': self._profiler_type[rows],
+        })
+
+
+class _Categories():
+    """Column of repeated strings, stored as integer codes."""
+
+    def __init__(self, values: pandas.Series):
+        categorical = values.astype('category')
+        self._codes = categorical.cat.codes.to_numpy()
+        self._categories = categorical.cat.categories.to_numpy()
+
+    def isin(self, values: list) -> np.ndarray:
+        return np.isin(self._codes, np.flatnonzero(np.isin(self._categories, values)))
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        codes = self._codes[rows]
+        if len(self._categories) == 0:
+            return np.full(len(codes), None, dtype=object)
+        return np.where(codes >= 0, self._categories[np.maximum(codes, 0)], None)
+
+
+def _as_list(value) -> list:
+    return value if isinstance(value, list) else [value]
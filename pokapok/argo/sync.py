@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pandas
+
+from ..cache import atomic_path
+from ..listing import ListingEntry
+
+
+WATERMARKS_DIR = Path('argo', 'sync')
+"""Sub-directory of the cache directory where float listings are stored
+between synchronisations."""
+
+
+def listing_snapshot(entries: list[ListingEntry]) -> dict[str, list]:
+    """Last modification date and size of each file of a listing, by name."""
+    return {e.name: [e.last_modified, e.size] for e in entries}
+
+
+def diff_listing(
+        current: dict[str, list],
+        previous: dict[str, list] | None = None,
+        since: Any = None,
+        cached: set[str] | frozenset[str] = frozenset()) -> dict[str, list[str]]:
+    """
+    Files added, updated and removed in a directory listing.
+
+    Files are changed if their listing date is not before `since`, when
+    given, or else if their date or size differ from the previous snapshot.
+    Without either, every file is considered changed.
+
+    Args:
+        current: Snapshot of the listing (see `listing_snapshot`).
+        previous: Snapshot of the listing at the previous synchronisation.
+        since: Date from which files are changed, anything `pandas.Timestamp` accepts.
+        cached: Names of the files already downloaded, used to tell added
+            from updated files when there is no previous snapshot.
+
+    Returns:
+        The names of the `added`, `updated` and `removed` files.
+    """
+    known = set(previous) if previous is not None else set(cached)
+    if since is not None:
+        since = pandas.Timestamp(since)
+        # files with an unreadable date are fetched again
+        changed = [name for name, (last_modified, _) in current.items()
+                   if not pandas.to_datetime(last_modified, errors='coerce') < since]
+    elif previous is not None:
+        changed = [name for name, entry in current.items() if previous.get(name) != entry]
+    else:
+        changed = list(current)
+    return {
+        'added': [name for name in changed if name not in known],
+        'updated': [name for name in changed if name in known],
+        'removed': sorted(set(previous or ()) - set(current)),
+    }
+
+
+class WatermarkStore():
+    """
+    Listing of each float's profiles at its last synchronisation, kept in
+    the cache directory.
+    """
+
+    def __init__(self, cache_dir: str | Path):
+        """
+        Listing of each float's profiles at its last synchronisation.
+
+        Args:
+            cache_dir: Cache directory where to store the listings.
+        """
+        self._dir = Path(cache_dir).joinpath(WATERMARKS_DIR)
+
+    def _file_path(self, dac: str, float: str) -> Path:
+        return self._dir.joinpath(dac, f'{float}.json')
+
+    def load(self, dac: str, float: str) -> dict[str, list] | None:
+        """Snapshot of the float's listing at its last synchronisation, if any."""
+        try:
+            with open(self._file_path(dac, float)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, dac: str, float: str, snapshot: dict[str, list]):
+        """Record the float's listing once synchronised."""
+        with atomic_path(self._file_path(dac, float)) as tmp_path, open(tmp_path, 'w') as file:
+            json.dump(snapshot, file)
@@ -1,21 +1,27 @@
 from pathlib import Path
-from typing import Any
-from urllib.parse import urljoin
-from bs4 import BeautifulSoup
+from typing import Any, Callable, Container
+import itertools
 import re
 import requests
+import threading
+from time import time
 import xarray
-import time
 import pandas as pd 
 import os
 
 from ..broker import Broker
 from ..cache import Directory
 from ..config import Config
+from ..download import DownloadScheduler, RetryPolicy
+from ..listing import ListingCache, ListingEntry
 from ..namedqueries import NamedQueryInfo, QueryName, QUERY_NAMES, QUERY_REGISTRY
+from ..pipeline import pipelined
 from ..result import Result
 
-from .data import cat_datasets
+from .aggregates import Aggregate, AggregateStore, FileStamp
+from .data import cat_datasets, include_meta, interpolate_levels, scan_header
+from .index import META_INDEX_FILENAME, PROFILE_INDEX_FILENAMES, ProfileIndex, read_dac_index
+from .sync import WatermarkStore, diff_listing, listing_snapshot
 from .types import FloatMode, FloatType
 
 import logging
@@ -24,6 +30,7 @@ logger = logging.getLogger("qcv_ingester_log")
 
 
 localBrokerQueryNames: list[QueryName] = [
+    'urn:pokapok:udal:argo:list',
     'urn:pokapok:udal:argo:meta',
     'urn:pokapok:udal:argo:data',
     'urn:pokapok:udal:argo:files',
@@ -38,6 +45,11 @@ ARGO_URLS = [
     'https://usgodae.org/pub/outgoing/argo',
 ]
 
+ARGO_DACS = ["aoml", "bodc", "coriolis", "csio", "csiro", "incois", "jma" ,"kma", "kordi", "meds", "nmdis"]
+
+DATA_RETRY = RetryPolicy(attempts=3, wait=40., exceptions=(requests.exceptions.RequestException,), skip=True)
+"""Retries of profile file downloads; files that still fail are skipped."""
+
 
 def _re_enum_options(enum) -> str:
     def value(e):
@@ -57,6 +69,10 @@ class ArgoBroker(Broker):
 
     _url: str
     _config: Config
+    _downloader: DownloadScheduler
+    _dacs: dict[str, str] | None
+    _listings: ListingCache
+    _profile_indexes: dict[FloatType, tuple[int, ProfileIndex]]
 
     _query_names: list[QueryName] = localBrokerQueryNames
 
@@ -67,6 +83,18 @@ class ArgoBroker(Broker):
             raise Exception('Unsupported Argo URL')
         self._url = url
         self._config = config
+        self._downloader = DownloadScheduler(config.download_workers, config.download_host_connections)
+        self._dacs = None
+        self._dacs_refreshed_at = None
+        self._unknown_floats: dict[str, float] = {}
+        self._listings = ListingCache(config.session, config.cache_dir, config.listing_ttl)
+        self._profile_indexes = {}
+        self._profile_index_lock = threading.Lock()
+        self._dac_index_lock = threading.Lock()
+        self._aggregates = None
+        if config.cache_dir is not None and config.argo_store_aggregates:
+            self._aggregates = AggregateStore(config.cache_dir)
+        self._watermarks = None if config.cache_dir is None else WatermarkStore(config.cache_dir)
 
     @property
     def queryNames(self) -> list[str]:
@@ -115,38 +143,70 @@ class ArgoBroker(Broker):
             d = ''
         return f'.*/{mt}([0-9]*)_([0-9]*){d}\\.nc$'
         
+    def _listing_expired(self, checked_at: float | None) -> bool:
+        ttl = self._config.listing_ttl
+        return checked_at is None or (ttl is not None and time() - checked_at >= ttl)
+
+    def _dac_index(self, refresh: bool = False) -> dict[str, str]:
+        """Float to DAC index, read from the GDAC metadata index file.
+
+        The index is refreshed at most once per `listing_ttl`."""
+        with self._dac_index_lock:
+            refresh = refresh and self._listing_expired(self._dacs_refreshed_at)
+            if self._dacs is None or refresh:
+                if refresh:
+                    self._dacs_refreshed_at = time()
+                try:
+                    with Directory.from_config(self._config, self._downloader) as dir:
+                        index_path = dir.download(f'{self._url}/{META_INDEX_FILENAME}', Path('argo'),
+                                                  mkdir=True, refresh=refresh)
+                        dacs = read_dac_index(index_path)
+                except requests.exceptions.RequestException as req_err:
+                    logger.error(f"Could not get the DAC index - Error: {req_err}")
+                    dacs = {}
+                # Keep the floats found by crawling the DAC listings
+                self._dacs = (self._dacs or {}) | dacs
+            return self._dacs
+
+    def _dac_float_dirs(self, dac_url: str) -> set[str] | None:
+        try:
+            return {e.name for e in self._listings.get(dac_url, directories=True)}
+        except requests.exceptions.RequestException as req_err:
+            logger.error(f"Error: Could not access {dac_url} - Error: {req_err}")
+            return None
+
     def _find_the_dac(self, url, float):
-        good_dac = None
-        
-        for dac in ["aoml", "bodc", "coriolis", "csio", "csiro", "incois", "jma" ,"kma", "kordi", "meds", "nmdis"]:         
-            dac_url = f"{url}/{dac}"
-            response = requests.get(dac_url)  
-    
-            if response.status_code != 200:
-                logger.error(f"Error: Could not access {dac_url}")
-                return []
+        """DAC of a float, from the index or else from the DAC listings.
+
+        Floats found nowhere are remembered for `listing_ttl`, so asking for
+        them again does not search again."""
+        dac = self._dac_index().get(float)
+        if dac is not None:
+            return dac
+        with self._dac_index_lock:
+            unknown = not self._listing_expired(self._unknown_floats.get(float))
+        if unknown:
+            raise KeyError("no corresponding dac found --> exiting")
 
-            soup = BeautifulSoup(response.text, 'html.parser')        
-            # Find all links in the directory listing
-            hrefs = [a['href'] for a in soup.find_all('a')]
-            
-            if f"{float}/" in hrefs:
-                good_dac = dac
-                break
+        # The float may be newer than the cached index
+        dac = self._dac_index(refresh=True).get(float)
+        if dac is not None:
+            return dac
 
-        if good_dac:
-            return good_dac
-        else:
-            raise KeyError("no corresponding dac found --> exiting")
+        # Fall back to the DAC listings
+        dac_urls = [f"{url}/{dac}/" for dac in ARGO_DACS]
+        for dac, dirs in zip(ARGO_DACS, self._downloader.map(self._dac_float_dirs, dac_urls)):
+            if dirs is not None and f"{float}/" in dirs:
+                with self._dac_index_lock:
+                    self._dacs[float] = dac
+                return dac
+
+        with self._dac_index_lock:
+            self._unknown_floats[float] = time()
+        raise KeyError("no corresponding dac found --> exiting")
 
     def _web_file_urls(self, url: str) -> list[str]:
-        # TODO Error handling.
-        page = requests.get(url)
-        soup = BeautifulSoup(page.content, 'html.parser')
-        links = soup.find_all('a')
-        links = filter(lambda l: l['href'] == l.text and not l.text.endswith('/'), links)
-        links = map(lambda l: urljoin(url, l.text), links)
-        return list(links)
+        return [e.url for e in self._listings.get(url)]
 
     def _meta_file_urls(self, dac: str, float: str) -> list[str]:
         return [self._argo_float_url(dac, float) + f'{float}_meta.nc']
@@ -156,41 +216,124 @@ class ArgoBroker(Broker):
         return self._web_file_urls(self._argo_float_profiles_url(dac, float))
 
     def _filter_argo_float_files(self, float_mode, float_type, descending_cycles, float_files: list[str]) -> list[str]:
+        """Keep the matching profile files, sorted in cycle order (ascending
+        before descending profile of the same cycle)."""
         file_re = re.compile(self._argo_file_name_re(float_mode, float_type, descending_cycles))
         argo_files = []
         for f in float_files:
-            if file_re.match(f) is not None:
-                argo_files.append(f)
-        return argo_files
-
-    def _try_to_dl_data(dl_line, **kwargs):
-        all_files = kwargs.get(all_files) 
-        url = kwargs.get(url) 
-        path = kwargs.get(path)
-        retries = 3
-        for attempt in range(retries):
-            try:
-                logger.info(f"Attempt {attempt + 1} for file: {url}")
-                all_files.append(str(dl_line))
-                logger.info(f"Successfully downloaded: {url}")
-                c+=1
-                break  # Break out of the retry loop if successful
-            
-            except requests.exceptions.RequestException as req_err:
-                logger.error(f"Attempt {attempt + 1} failed for {url} - Error: {req_err}")
-                if attempt < retries - 1:
-                    # If not the last attempt, retry after a brief pause
-                    logger.info(f"Retrying in 40 seconds... (Attempt {attempt + 2}/{retries})")
-                    time.sleep(40)
-                else:
-                    # If the final attempt fails, log the failure
-                    logger.error(f"Failed to download {url} after {retries} attempts.")
-                    pass
-            except Exception as e:
-                # Catch any other unforeseen errors
-                logger.error(f"Unexpected error occurred for {url}: {e}")
-                pass
-            
+            match = file_re.match(f)
+            if match is not None:
+                argo_files.append((int(match.group(2) or 0), f.endswith('D.nc'), f))
+        return [f for *_, f in sorted(argo_files)]
+
+    def _try_to_dl_data(self, url: str, dir: Directory, path: str|Path,
+                        refresh: Container[str] = ()) -> str:
+        # retried by the scheduler (see DATA_RETRY), without holding a
+        # connection to the host between attempts
+        return str(dir.download(url, path, mkdir=True, refresh=url in refresh))
+
+    def _profile_index(self, float_type: FloatType) -> ProfileIndex:
+        """GDAC profile index of a float type, reloaded when the cached index
+        file changes."""
+        with self._profile_index_lock:
+            cached = self._profile_indexes.get(float_type)
+            if cached is not None and self._config.cache_dir is None:
+                # the index file does not outlive the temporary directory
+                return cached[1]
+            with Directory.from_config(self._config, self._downloader) as dir:
+                index_path = dir.download(f'{self._url}/{PROFILE_INDEX_FILENAMES[float_type]}', Path('argo'), mkdir=True)
+                stamp = index_path.stat().st_mtime_ns
+                if cached is None or cached[0] != stamp:
+                    logger.info(f"loading profile index {index_path.name}")
+                    cached = (stamp, ProfileIndex(index_path, float_type))
+                    self._profile_indexes[float_type] = cached
+            return cached[1]
+
+    def _execute_argo_list(self, params: dict[str, Any]):
+        float_type = params.get('float_type')
+        if float_type is None:
+            float_types = [FloatType.CORE]
+        elif isinstance(float_type, FloatType):
+            float_types = [float_type]
+        else:
+            float_types = list(float_type)
+
+        float_mode = params.get('float_mode')
+        if float_mode is None or float_mode == FloatMode.ALL or str(float_mode).lower() in ('none', 'all'):
+            float_modes = None
+        elif isinstance(float_mode, list):
+            float_modes = [str(m) for m in float_mode]
+        else:
+            float_modes = [str(float_mode)]
+
+        descending_cycles = params.get('descending_cycles')
+        if descending_cycles == None:
+            descending_cycles = True
+
+        profiles = []
+        for ft in float_types:
+            profiles.append(self._profile_index(ft).select(
+                lon_min=params.get('lon_min'),
+                lon_max=params.get('lon_max'),
+                lat_min=params.get('lat_min'),
+                lat_max=params.get('lat_max'),
+                time_min=params.get('time_min'),
+                time_max=params.get('time_max'),
+                dac=params.get('dac'),
+                float=params.get('float'),
+                float_mode=float_modes,
+                descending_cycles=descending_cycles))
+        result = pd.concat(profiles, ignore_index=True)
+        result.insert(0, 'url', f'{self._url}/dac/' + result['file'].astype(str))
+        return result
+
+    def _directory(self, sync: bool = False) -> Directory:
+        """Cache directory for a query. When syncing, files that did not change
+        in the listing are served from the cache without checking the server."""
+        return Directory.from_config(self._config, self._downloader, expire=not sync)
+
+    def _sync_argo(self, params: dict[str, Any], run: Callable[[dict[str, Any], set[str]], Any]):
+        """
+        Run an Argo query in sync mode: only the profile files whose listing
+        date or size changed since `params['since']`, or else since the
+        float's previous sync, are downloaded again.
+
+        `run(params, refresh)` runs the query, with the URLs to refresh.
+        Returns its result, with the `added`, `updated` and `removed` files.
+        """
+        float = params.get('float')
+        if float == None:
+            raise Exception('missing float argument')
+        dac = params.get('dac') or self._find_the_dac(f"{self._url}/dac", float)
+        descending_cycles = params.get('descending_cycles')
+        if descending_cycles == None:
+            descending_cycles = True
+
+        def matching(urls):
+            return self._filter_argo_float_files(params.get('float_mode'), params.get('float_type'), descending_cycles, urls)
+
+        profiles_url = self._argo_float_profiles_url(dac, float)
+        listing = self._listings.get(profiles_url, refresh=True)
+        kept = set(matching([e.url for e in listing]))
+        current = listing_snapshot([e for e in listing if e.url in kept])
+        previous = None if self._watermarks is None else self._watermarks.load(dac, float)
+        if previous is not None:
+            kept_previous = {os.path.basename(url) for url in matching([profiles_url + name for name in previous])}
+            previous = {name: entry for name, entry in previous.items() if name in kept_previous}
+        cached = set()
+        if self._config.cache_dir is not None:
+            profile_dir = Path(self._config.cache_dir, 'argo', 'dac', dac, float, 'profiles')
+            if profile_dir.is_dir():
+                cached = {f.name for f in profile_dir.iterdir()}
+
+        changes = diff_listing(current, previous, params.get('since'), cached)
+        logger.info(f"{float} sync: {len(changes['added'])} added, {len(changes['updated'])} updated, "
+                    f"{len(changes['removed'])} removed")
+        result = run(params | {'dac': dac}, {profiles_url + name for name in changes['added'] + changes['updated']})
+        if self._watermarks is not None:
+            self._watermarks.save(dac, float, listing_snapshot(listing))
+        return result, changes
+
     def _execute_argo_meta(self, params: dict[str, Any]):
         dac = params.get('dac')
         if dac == None:
@@ -200,7 +343,7 @@ class ArgoBroker(Broker):
             raise Exception('missing float argument')
         [url] = self._meta_file_urls(dac, float)
         result = None
-        with Directory(self._config.cache_dir) as dir:
+        with Directory.from_config(self._config, self._downloader) as dir:
             meta_path = Path('argo', 'dac', dac, float)
             f = str(dir.download(url, meta_path, mkdir=True))
             meta = xarray.open_dataset(f)
@@ -214,7 +357,7 @@ class ArgoBroker(Broker):
             }
         return result
 
-    def _execute_argo_data(self, params: dict[str, Any]):
+    def _argo_data_urls(self, params: dict[str, Any]):
         dac = params.get('dac')
         if dac == None:
             raise Exception('missing dac argument')
@@ -226,21 +369,170 @@ class ArgoBroker(Broker):
         descending_cycles = params.get('descending_cycles')
         if descending_cycles == None:
             descending_cycles = True
+        if params.get('lazy') and self._config.cache_dir is None:
+            # the temporary directory is gone by the time variables are computed
+            raise Exception('lazy argo:data requires a cache directory')
+        if params.get('lazy') and self._argo_data_filters(params):
+            # profiles and levels are filtered from the values of each file
+            raise Exception('qc_flags, data_mode and prefer_adjusted are not supported with lazy argo:data')
+        if params.get('levels') is not None and (params.get('layout') or 'dense') != 'dense':
+            raise Exception('levels are only supported with the dense layout')
         argo_file_urls = self._filter_argo_float_files(float_mode, float_type, descending_cycles, self._file_urls(dac, float))
         meta_file_urls = self._meta_file_urls(dac, float)
-        all_files = []
+        return dac, float, argo_file_urls, meta_file_urls
+
+    def _argo_data_options(self, params: dict[str, Any]) -> dict[str, Any]:
+        return {
+            'layout': params.get('layout') or 'dense',
+            'lazy': bool(params.get('lazy')),
+            'chunks': params.get('chunks') or self._config.argo_chunks,
+            'dask_options': self._config.dask_options,
+            'partition_size': self._config.dask_partition_size,
+        }
+
+    @staticmethod
+    def _argo_data_filters(params: dict[str, Any]) -> dict[str, Any]:
+        """Filters applied to each profile file as it is read (see
+        `data.filter_profiles`)."""
+        filters: dict[str, Any] = {}
+        for name in ('qc_flags', 'data_mode'):
+            value = params.get(name)
+            if value is None:
+                continue
+            if isinstance(value, (str, int)):
+                value = [value]
+            filters[name] = sorted(str(v) for v in value)
+        if params.get('prefer_adjusted'):
+            filters['prefer_adjusted'] = True
+        return filters
+
+    def _scanned_profiles(self, dir: Directory, urls: list[str], path: Path,
+                          refresh: Container[str] = (), filters: dict[str, Any] | None = None):
+        """Download profile files and scan their headers while the next ones
+        are still downloading, yielding `(file, header)` in order.
+
+        Values are only read afterwards, in batches, when aggregating."""
+        def download(url, **kwargs):
+            return dir.download(url, refresh=url in refresh, **kwargs)
+
+        downloads = self._downloader.imap(download, urls, path=path, mkdir=True)
+
+        def scan(file):
+            return str(file), scan_header(str(file), filters)
+
+        return pipelined(scan, downloads,
+                         workers=self._config.decode_workers,
+                         maxsize=self._config.pipeline_queue_size)
+
+    def _argo_data_levels(self, dataset, params: dict[str, Any]):
+        """Aggregated dataset interpolated onto the `levels` parameter, if
+        given, of `level_variable` (`PRES` by default)."""
+        levels = params.get('levels')
+        if levels is None:
+            return dataset
+        try:
+            return interpolate_levels(dataset, levels, params.get('level_variable') or 'PRES')
+        except ValueError as e:
+            raise Exception(str(e))
+
+    def _execute_argo_data(self, params: dict[str, Any], refresh: Container[str] | None = None):
+        # the raw aggregate is stored, and interpolated for each query
+        return self._argo_data_levels(self._aggregate_argo_data(params, refresh), params)
+
+    def _aggregate_argo_data(self, params: dict[str, Any], refresh: Container[str] | None = None):
+        dac, float, argo_file_urls, meta_file_urls = self._argo_data_urls(params)
+        options = self._argo_data_options(params)
         meta_path = Path('argo', 'dac', dac, float)
         profile_path = Path('argo', 'dac', dac, float, 'profiles')
-        with Directory(self._config.cache_dir) as dir:
-            for url in argo_file_urls:
-                all_files.append(str(dir.download(url, profile_path, mkdir=True)))
-            for url in meta_file_urls:
-                all_files.append(str(dir.download(url, meta_path, mkdir=True)))
-        results = cat_datasets([all_files])
+        with self._directory(sync=refresh is not None) as dir:
+            refresh = refresh or ()
+            meta_files = [str(f) for f in self._downloader.map(dir.download, meta_file_urls, path=meta_path, mkdir=True)]
+            if self._aggregates is not None and not options['lazy']:
+                return self._stored_argo_data(dir, dac, float, argo_file_urls, profile_path, meta_files, params, options, refresh)
+            filters = self._argo_data_filters(params)
+            profiles = list(self._scanned_profiles(dir, argo_file_urls, profile_path, refresh, filters))
+            all_files = [f for f, _ in profiles] + meta_files
+            results = cat_datasets([all_files], headers=[h for _, h in profiles], filters=filters, **options)
         return results
 
+    def _stored_argo_data(self,
+            dir: Directory,
+            dac: str,
+            float: str,
+            urls: list[str],
+            path: Path,
+            meta_files: list[str],
+            params: dict[str, Any],
+            options: dict[str, Any],
+            refresh: Container[str] = ()):
+        """Aggregated dataset of a float, served from the aggregate store when
+        its profile files did not change, or extended with the new cycles
+        when files were only added after the stored ones."""
+        filters = self._argo_data_filters(params)
+        key = {
+            'float_mode': params.get('float_mode'),
+            'float_type': params.get('float_type'),
+            'descending_cycles': params.get('descending_cycles'),
+            'layout': options['layout'],
+        } | filters
+
+        def scan(file):
+            return scan_header(file, filters)
+
+        stored = self._aggregates.load(dac, float, key)
+        base, base_files = None, 0
+        if stored is None:
+            profiles = list(self._scanned_profiles(dir, urls, path, refresh, filters))
+            files = [f for f, _ in profiles]
+            headers = [h for _, h in profiles]
+        else:
+            def download(url, **kwargs):
+                return dir.download(url, refresh=url in refresh, **kwargs)
+
+            files = [str(f) for f in self._downloader.map(download, urls, path=path, mkdir=True)]
+            stamps = [FileStamp.of(f) for f in files]
+            n = len(stored.files)
+            if stamps == stored.files:
+                logger.info(f"{float} aggregate up to date")
+                return include_meta(meta_files[0] if meta_files else None, stored.dataset)
+            if n > 0 and stamps[:n] == stored.files:
+                logger.info(f"{float} appending {len(files) - n} profiles to the stored aggregate")
+                base, base_files = stored.dataset, n
+                headers = list(stored.headers) + \
+                    list(pipelined(scan, files[n:], workers=self._config.decode_workers))
+            else:
+                headers = list(pipelined(scan, files, workers=self._config.decode_workers))
+        results = cat_datasets([files + meta_files], headers=headers, filters=filters,
+                               base=base, base_files=base_files, **options)
+        self._aggregates.save(dac, float, key, Aggregate(
+            [FileStamp.of(f) for f in files], headers, results))
+        return results
+
+    def _iter_argo_data(self, params: dict[str, Any], n: int):
+        """Aggregated datasets of `n` profiles each, in cycle order, each
+        aggregated as soon as its files are downloaded."""
+        dac, float, argo_file_urls, meta_file_urls = self._argo_data_urls(params)
+        options = self._argo_data_options(params)
+        meta_path = Path('argo', 'dac', dac, float)
+        profile_path = Path('argo', 'dac', dac, float, 'profiles')
+        with Directory.from_config(self._config, self._downloader) as dir:
+            meta_files = [str(f) for f in self._downloader.map(dir.download, meta_file_urls, path=meta_path, mkdir=True)]
+            filters = self._argo_data_filters(params)
+            scanned = self._scanned_profiles(dir, argo_file_urls, profile_path, filters=filters)
+            for profiles in _batched(scanned, n):
+                files = [f for f, _ in profiles] + meta_files
+                yield self._argo_data_levels(
+                    cat_datasets([files], headers=[h for _, h in profiles], filters=filters, **options), params)
+
+
+    def _execute_argo_files(self, params: dict[str, Any], refresh: Container[str] | None = None):
+        return list(itertools.chain.from_iterable(self._iter_argo_files(params, 64, refresh)))
+
+    def _iter_argo_files(self, params: dict[str, Any], n: int, refresh: Container[str] | None = None):
+        """Paths of the downloaded files, in batches of `n` yielded as soon
+        as they are downloaded.
 
-    def _execute_argo_files(self, params: dict[str, Any]):
+        When syncing, `refresh` gives the URLs to check against the server."""
         
         # section = float mode
         float_mode = params.get('float_mode')
@@ -271,7 +563,7 @@ class ArgoBroker(Broker):
         argo_file_urls = self._filter_argo_float_files(float_mode, float_type, descending_cycles, self._file_urls(dac, float))
         meta_file_urls = self._meta_file_urls(dac, float)
 
-        all_files = []
+        meta_files = []
         
         if params.get('bypass_out_arch_building'):       
             profile_path=""
@@ -281,55 +573,55 @@ class ArgoBroker(Broker):
             profile_path = Path('argo', 'dac', dac, float, 'profiles')
             
         
-        with Directory(self._config.cache_dir) as dir:
+        with self._directory(sync=refresh is not None) as dir:
+            refresh = refresh or ()
             logger.info(f"start downloading meta file")
             if params.get('incl_meta'):
                 for url in meta_file_urls:
-                    all_files.append(str(dir.download(url, meta_path, mkdir=True)))
+                    meta_files.append(str(dir.download(url, meta_path, mkdir=True)))
             logger.info(f"DL meta file : END !")
                 
-            logger.info(f"start downloading meta file")
+            logger.info(f"start downloading profile files")
             logger.info(f"{len(argo_file_urls)} files to DL.. Start !")
-            c=1
-            for url in argo_file_urls:
-                logger.info(f"PROCESS file n° {c}/{len(argo_file_urls)}")
-                retries = 3
-                wait_s = 40
-                for attempt in range(retries):
-                    try:
-                        # logger.info(f"Attempt {attempt + 1} for file: {url}")
-                        all_files.append(str(dir.download(url, profile_path, mkdir=True)))
-                        # logger.info(f"Successfully downloaded: {url}")
-                        c+=1
-                        break  # Break out of the retry loop if successful
-                    
-                    except requests.exceptions.RequestException as req_err:
-                        logger.error(f"Attempt {attempt + 1} failed for {url} - Error: {req_err}")
-                        if attempt < retries - 1:
-                            # If not the last attempt, retry after a brief pause
-                            logger.info(f"Retrying in {wait_s} seconds... (Attempt {attempt + 2}/{retries})")
-                            time.sleep(wait_s)
-                        else:
-                            # If the final attempt fails, log the failure
-                            logger.error(f"Failed to download {url} after {retries} attempts.")
-                            pass
-                    except Exception as e:
-                        # Catch any other unforeseen errors
-                        logger.error(f"Unexpected error occurred for {url}: {e}")
-                        pass
-                    
+
+            def profile_files():
+                c=1
+                for f in self._downloader.imap(self._try_to_dl_data, argo_file_urls, DATA_RETRY,
+                                                     dir=dir, path=profile_path, refresh=refresh):
+                    logger.info(f"PROCESS file n° {c}/{len(argo_file_urls)}")
+                    c+=1
+                    if f is not None:
+                        yield f
+
+            for files in _batched(itertools.chain(meta_files, profile_files()), n):
+                yield files
+
         logger.info(f" end downloads! youpi")
         
     def execute(self, qn: QueryName, params: dict[str, Any] | None = None) -> Result:
         query = ArgoBroker._queries[qn]
         queryParams = params or {}
         match qn:
+            case 'urn:pokapok:udal:argo:list':
+                return Result(query, self._execute_argo_list(queryParams))
             case 'urn:pokapok:udal:argo:meta':
                 return Result(query, self._execute_argo_meta(queryParams))
+            case 'urn:pokapok:udal:argo:data' | 'urn:pokapok:udal:argo:files' if queryParams.get('sync'):
+                if queryParams.get('stream'):
+                    raise Exception('synced results cannot be streamed')
+                run = self._execute_argo_data if qn == 'urn:pokapok:udal:argo:data' else self._execute_argo_files
+                data, changes = self._sync_argo(queryParams, run)
+                return Result(query, data, changes)
             case 'urn:pokapok:udal:argo:data':
-                return Result(query, self._execute_argo_data(queryParams))
+                batches = lambda n: self._iter_argo_data(queryParams, n)
+                if queryParams.get('stream'):
+                    return Result(query, batches=batches)
+                return Result(query, self._execute_argo_data(queryParams), batches=batches)
             case 'urn:pokapok:udal:argo:files':
-                return Result(query, self._execute_argo_files(queryParams))
+                batches = lambda n: self._iter_argo_files(queryParams, n)
+                if queryParams.get('stream'):
+                    return Result(query, batches=batches)
+                return Result(query, self._execute_argo_files(queryParams), batches=batches)
             case _:
                 if qn in QUERY_NAMES:
                     raise Exception(f'unsupported query name "{qn}"')
@@ -375,16 +667,25 @@ class ArgoBroker(Broker):
         if descending_cycles == None:
             descending_cycles = True
             
-        argo_file_urls = self._filter_argo_float_files(float_mode, float_type, descending_cycles, self._file_urls(dac, float))
+        # A single listing fetch serves both the file filtering and the dates
+        listing = self._listings.get(self._argo_float_profiles_url(dac, float))
+        argo_file_urls = self._filter_argo_float_files(float_mode, float_type, descending_cycles, [e.url for e in listing])
         argo_files = []
         [argo_files.append(os.path.basename(file)) for file in argo_file_urls]
         
-        df_html = pd.read_html(f"{self._argo_float_url(dac, float)}/profiles")[0][["Name", "Last modified"]].dropna(axis=0)
+        df_html = pd.DataFrame(listing, columns=ListingEntry._fields)[["name", "last_modified"]].dropna(axis=0)
         
-        mask = df_html['Name'].isin(argo_files)
+        mask = df_html['name'].isin(argo_files)
         df_html = df_html[mask]
-        last_date = pd.to_datetime(df_html["Last modified"].max()).strftime("%Y%m%d")
+        last_date = pd.to_datetime(df_html["last_modified"]).max().strftime("%Y%m%d")
         
         return last_date
         
         
+
+
+def _batched(iterable, n: int):
+    """Lists of `n` items of an iterable, the last one possibly shorter."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, n)):
+        yield batch
@@ -1,17 +1,71 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+import hashlib
 import os
 from pathlib import Path
 import shutil
 import tempfile
+import threading
+from typing import Callable, Hashable, Iterator
 from urllib.parse import urlparse
 import requests
+import xarray
 import logging
-from time import time
+from time import sleep, time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from .download import DownloadScheduler
+from .manifest import MANIFEST_FILENAME, Manifest, ManifestEntry
 
 # Get the logger for the library (it will use the root logger by default)
 logger = logging.getLogger("qcv_ingester_log")
 
 TEMP_DIR_PREFIX = 'pokapok-udal-'
 
+PART_SUFFIX = '.part'
+"""Suffix of files being downloaded."""
+
+LOCKS_DIR = '.locks'
+"""Hidden sub-directory of the cache directory holding the lock files that
+guard cache entries, named after a hash of the entry's path."""
+
+CHUNK_SIZE = 1 << 20
+
+
+@contextmanager
+def atomic_path(file_path: Path) -> Iterator[Path]:
+    """
+    Temporary path to write a file or directory to, moved to `file_path`
+    once written, so that readers never see it partially written.
+
+    The temporary path is unique to the process and thread, and is removed
+    if writing fails. Parent directories are created if needed.
+
+    Args:
+        file_path: Final path of the file or directory.
+
+    Returns:
+        The path to write to until the context exits.
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(f'{file_path.name}.{os.getpid()}.{threading.get_ident()}')
+    try:
+        yield tmp_path
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if tmp_path.is_dir():
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        else:
+            tmp_path.unlink(missing_ok=True)
+        raise
+
 
 class Directory():
     """
@@ -19,9 +73,31 @@ class Directory():
 
     A temporary directory is used if no path to an existing directory is given.
     Any given path must exist and be writeable.
+
+    Downloaded files are recorded in a manifest at the root of the directory.
+    Files checked against the server less than `ttl` seconds ago are served
+    without any request; older ones are revalidated with a conditional request.
+    Before a file is revalidated, its content is checked against the SHA-256
+    recorded at download time, and it is downloaded again if it differs.
+
+    Files are downloaded to a `.part` file, which is renamed into place once
+    complete. Interrupted downloads are resumed with HTTP range requests, and
+    large files may be fetched as several byte ranges in parallel, using the
+    connections to their host that the download scheduler has left.
+
+    The directory can be shared by several processes: each entry is guarded
+    by an advisory lock, so a file is only downloaded once and concurrent
+    requests for it wait for that download to finish. Lock files are kept
+    apart, in a hidden `.locks` directory, and reused by later downloads.
     """
 
-    def __init__(self, path: str | Path | None = None, ):
+    def __init__(self,
+            path: str | Path | None = None,
+            ttl: float | None = None,
+            session: requests.Session | None = None,
+            segments: int = 1,
+            segment_min_size: int = 64 << 20,
+            scheduler: DownloadScheduler | None = None):
         """
         Cache directory to store downloaded files.
 
@@ -30,20 +106,53 @@ class Directory():
 
         Args:
             path: Path to the cache directory.
+            ttl: Number of seconds during which a downloaded file is used
+                without checking the server. `None` means files never expire.
+            session: HTTP session used for downloads. Defaults to a new session.
+            segments: Number of byte ranges to download in parallel for large files.
+            segment_min_size: Size (in bytes) from which a file is downloaded in segments.
+            scheduler: Scheduler running the downloads. Byte ranges beyond the
+                first are charged against its per-host connection limit.
         """
         self._path = path
         self._tmp_dir = None
+        self._ttl = ttl
+        self._manifest = None
+        self._session = session or requests.Session()
+        self._segments = segments
+        self._segment_min_size = segment_min_size
+        self._scheduler = scheduler
+
+    @classmethod
+    def from_config(cls, config, scheduler: DownloadScheduler | None = None, expire: bool = True) -> 'Directory':
+        """Cache directory set up from a `Config`, for downloads run by
+        `scheduler`. Unless `expire`, cached files never expire."""
+        return cls(config.cache_dir, config.cache_ttl if expire else None, config.session,
+                   config.download_segments, config.download_segment_min_size, scheduler)
 
     def __enter__(self):
         if self._path is None:
             self._tmp_dir = tempfile.mkdtemp(prefix=TEMP_DIR_PREFIX)
+        root = self._path or self._tmp_dir
+        # switching a new manifest to WAL fails, rather than waits, when
+        # another process is creating it too
+        with self.lock(Path(root, MANIFEST_FILENAME)):
+            self._manifest = Manifest(root)
         return self
 
     def __exit__(self, type, value, traceback):
         if self._tmp_dir is not None:
             shutil.rmtree(self._tmp_dir)
 
-    def download(self, url: str, path: str|Path, mkdir: bool|None = None, filename: str|None = None):
+    def _is_fresh(self, entry: ManifestEntry) -> bool:
+        return self._ttl is None or time() - entry.checked_at < self._ttl
+
+    def download(self,
+            url: str,
+            path: str|Path,
+            mkdir: bool|None = None,
+            filename: str|None = None,
+            refresh: bool = False):
         """
         Download a file to the cache directory.
 
@@ -52,40 +161,330 @@ class Directory():
             path: Path within the cache directory where to download the file to.
             mkdir: If provided and `True`, build the required parent directories for the downloaded file.
             filename: Name for the downloaded file. Defaults to the name in the URL if not provided.
-        """        
-        dir = self._path or self._tmp_dir
-        if dir is None:
+            refresh: If `True`, check the server even if the cached file has not expired.
+        """
+        root = self._path or self._tmp_dir
+        if root is None or self._manifest is None:
             raise Exception('no directory to save download')
-        dir = Path(dir).joinpath(path)
+        dir = Path(root).joinpath(path)
         if filename is None:
             filename = Path(urlparse(url).path).name
         file_path = dir.joinpath(filename)
+        if mkdir:
+            dir.mkdir(parents=True, exist_ok=True)
+        key = file_path.relative_to(root).as_posix()
 
-        # print(f"file_path = {file_path}")
+        # Serve a fresh download without waiting for any lock: files are only
+        # published complete, by renaming.
+        requested_at = time()
+        entry = self._manifest.get(url, key)
+        if entry is not None and not refresh and self._is_fresh(entry) and _is_intact(entry, file_path):
+            logger.info(f"{filename} already dl, skip")
+            return file_path
 
-        # Start the download and compare the local file size during the request
-        with requests.get(url, stream=True) as response:
+        with self.lock(file_path):
+            return self._fetch(url, file_path, key, requested_at, refresh)
+
+    def lock(self, file_path: str | Path) -> '_EntryLock':
+        """
+        Exclusive lock on a file of the cache directory, shared by threads and
+        processes, e.g. to build a file derived from a download only once.
+
+        Args:
+            file_path: Path of the file, within the cache directory.
+        """
+        root = Path(self._path or self._tmp_dir)
+        key = Path(file_path).resolve().relative_to(root.resolve()).as_posix()
+        locks_dir = root.joinpath(LOCKS_DIR)
+        locks_dir.mkdir(exist_ok=True)
+        return _EntryLock(locks_dir.joinpath(hashlib.sha1(key.encode()).hexdigest() + '.lock'))
+
+    def _fetch(self, url: str, file_path: Path, key: str, requested_at: float, refresh: bool) -> Path:
+        """Download a file while holding the lock on its cache entry."""
+        filename = file_path.name
+
+        # Look for a previous download of the same URL that is still intact,
+        # possibly done by another worker while waiting for the lock
+        entry = self._manifest.get(url, key)
+        if entry is not None:
+            if not _is_intact(entry, file_path, verify=True):
+                # not adopted again by comparing sizes
+                file_path.unlink(missing_ok=True)
+                self._manifest.remove(url, key)
+                entry = None
+            elif entry.checked_at >= requested_at or (not refresh and self._is_fresh(entry)):
+                logger.info(f"{filename} already dl, skip")
+                return file_path
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        # Resume an interrupted download of the same version of the file
+        part_path = file_path.with_name(file_path.name + PART_SUFFIX)
+        part_key = key + PART_SUFFIX
+        part = self._manifest.get(url, part_key)
+        part_validator = None if part is None else (part.etag or part.last_modified)
+        offset = 0
+        if entry is None and part_validator is not None and part_path.exists():
+            offset = part_path.stat().st_size
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = part_validator
+
+        checked_at = time()
+        with self._session.get(url, stream=True, headers=headers) as response:
+            if entry is not None and response.status_code == 304:
+                logger.info(f"{filename} not modified, skip")
+                self._manifest.touch(url, key, checked_at)
+                return file_path
+            if response.status_code == 416:
+                # The partial file cannot be resumed, start over
+                part_path.unlink()
+                self._manifest.remove(url, part_key)
+                return self._fetch(url, file_path, key, requested_at, refresh)
             response.raise_for_status()
-            remote_file_size = int(response.headers.get('Content-Length', 0))
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            validator = etag or last_modified
 
-            if file_path.exists():
-                local_file_size = file_path.stat().st_size
+            if response.status_code == 206:
+                size = _content_range_size(response.headers.get('Content-Range'))
+                logger.info(f"{filename} resuming at {offset} bytes")
+            else:
+                offset = 0
+                size = int(response.headers.get('Content-Length', -1))
+                if 'Content-Encoding' in response.headers:
+                    size = -1
 
-                # If sizes match, assume the file is already fully downloaded
-                if local_file_size == remote_file_size:
-                    logger.info(f"{os.path.basename(path)} already dl, skip")
+                # Without validators, fall back to comparing sizes. This also adopts
+                # files downloaded before the manifest existed.
+                if file_path.exists() and file_path.stat().st_size == size \
+                        and (entry is None or (entry.etag is None and entry.last_modified is None)):
+                    logger.info(f"{filename} already dl, skip")
+                    self._manifest.put(ManifestEntry(url, key, size, etag, last_modified,
+                                                     _file_sha256(file_path), checked_at))
                     return file_path
 
-                # Otherwise, delete the incomplete file
-                file_path.unlink()
+            if validator != part_validator:
+                for segment_path in part_path.parent.glob(part_path.name + '.*'):
+                    segment_path.unlink()
+            self._manifest.put(ManifestEntry(url, part_key, size, etag, last_modified, '', checked_at))
+
+            segmentable = response.status_code == 200 and self._segments > 1 and size >= self._segment_min_size \
+                and validator is not None and response.headers.get('Accept-Ranges') == 'bytes'
+            with self._extra_connections(url, self._segments - 1 if segmentable else 0) as extra:
+                if extra > 0:
+                    response.close()
+                    self._download_segments(url, part_path, size, validator, extra + 1)
+                else:
+                    with open(part_path, 'ab' if offset else 'wb', buffering=CHUNK_SIZE) as file:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                file.write(chunk)
+
+        if size >= 0 and part_path.stat().st_size != size:
+            raise Exception(f'incomplete download of {url}')
+        os.replace(part_path, file_path)
+        self._manifest.remove(url, part_key)
+        self._manifest.put(ManifestEntry(url, key, file_path.stat().st_size, etag, last_modified,
+                                         _file_sha256(file_path), checked_at))
+
+        return file_path
+
+    def _extra_connections(self, url: str, n: int):
+        if self._scheduler is None:
+            return nullcontext(n)
+        return self._scheduler.extra_connections(url, n)
+
+    def _download_segments(self, url: str, part_path: Path, size: int, validator: str, segments: int):
+        """Download a file as parallel byte ranges, each saved to its own
+        resumable segment file, then join them into `part_path`."""
+        step = -(-size // segments)
+        bounds = [(i, start, min(start + step, size) - 1) for i, start in enumerate(range(0, size, step))]
+        # segments of an attempt split differently cover other byte ranges
+        names = {f'{part_path.name}.{len(bounds)}-{i}' for i, _, _ in bounds}
+        for segment_path in part_path.parent.glob(part_path.name + '.*'):
+            if segment_path.name not in names:
+                segment_path.unlink()
+
+        def download_segment(args):
+            i, start, end = args
+            segment_path = part_path.with_name(f'{part_path.name}.{len(bounds)}-{i}')
+            done = segment_path.stat().st_size if segment_path.exists() else 0
+            if done > end - start + 1:
+                segment_path.unlink()
+                done = 0
+            if start + done <= end:
+                headers = {'Range': f'bytes={start + done}-{end}', 'If-Range': validator}
+                with self._session.get(url, stream=True, headers=headers) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise Exception(f'range request not honoured for {url}')
+                    with open(segment_path, 'ab', buffering=CHUNK_SIZE) as file:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                file.write(chunk)
+            return segment_path
+
+        with ThreadPoolExecutor(max_workers=len(bounds)) as pool:
+            segment_paths = list(pool.map(download_segment, bounds))
+
+        with open(part_path, 'wb') as file:
+            for segment_path in segment_paths:
+                with open(segment_path, 'rb') as segment:
+                    shutil.copyfileobj(segment, file, CHUNK_SIZE)
+        for segment_path in segment_paths:
+            segment_path.unlink()
+
+
+class DatasetCache():
+    """
+    In-process LRU cache of opened datasets, shared by threads.
+
+    Datasets are evicted, least recently used first, when there are more
+    than `max_count` of them or their size exceeds `max_bytes`. Evicted
+    datasets are not closed, as callers may still hold views on them: their
+    files are closed once they are no longer referenced.
+    """
+
+    def __init__(self, max_count: int = 16, max_bytes: int | None = None):
+        """
+        In-process LRU cache of opened datasets, shared by threads.
+
+        Args:
+            max_count: Maximum number of datasets kept open.
+            max_bytes: Maximum total size (in bytes, once loaded) of the
+                datasets kept open. `None` means no limit.
+        """
+        self._max_count = max_count
+        self._max_bytes = max_bytes
+        self._datasets: OrderedDict[Hashable, tuple[xarray.Dataset, int]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._opening: dict[Hashable, threading.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._datasets)
+
+    def get(self, key: Hashable) -> xarray.Dataset | None:
+        """Dataset cached under a key, if any."""
+        with self._lock:
+            entry = self._datasets.get(key)
+            if entry is None:
+                return None
+            self._datasets.move_to_end(key)
+            return entry[0]
+
+    def get_or_open(self, key: Hashable, open: Callable[[], xarray.Dataset | None]) -> xarray.Dataset | None:
+        """
+        Dataset cached under a key, opened and cached if missing.
+
+        Concurrent calls for the same key open the dataset only once.
+
+        Args:
+            key: Key of the dataset.
+            open: Function opening the dataset. `None` results are not cached.
+        """
+        dataset = self.get(key)
+        if dataset is not None:
+            return dataset
+        with self._lock:
+            opening = self._opening.setdefault(key, threading.Lock())
+        with opening:
+            dataset = self.get(key)
+            if dataset is None:
+                dataset = open()
+                if dataset is not None:
+                    self._put(key, dataset)
+        with self._lock:
+            self._opening.pop(key, None)
+        return dataset
+
+    def _put(self, key: Hashable, dataset: xarray.Dataset):
+        nbytes = dataset.nbytes
+        with self._lock:
+            previous = self._datasets.pop(key, None)
+            if previous is not None:
+                self._nbytes -= previous[1]
+            self._datasets[key] = (dataset, nbytes)
+            self._nbytes += nbytes
+            # the newest dataset is kept even if it is over the limits
+            while len(self._datasets) > 1 and (len(self._datasets) > self._max_count or
+                    (self._max_bytes is not None and self._nbytes > self._max_bytes)):
+                _, (_, evicted_nbytes) = self._datasets.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+
+    def sources(self) -> set[Path]:
+        """Paths of the files or stores the cached datasets were opened from."""
+        with self._lock:
+            return {Path(dataset.encoding['source'])
+                    for dataset, _ in self._datasets.values() if 'source' in dataset.encoding}
+
+    def clear(self):
+        """Forget every cached dataset."""
+        with self._lock:
+            self._datasets.clear()
+            self._nbytes = 0
+
+
+class _EntryLock():
+    """Exclusive advisory lock on a cache entry, held through a lock file.
+
+    The lock is shared by threads and processes: each holder opens the lock
+    file on its own."""
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._path, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    sleep(1)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+
+def _is_intact(entry: ManifestEntry, file_path: Path, verify: bool = False) -> bool:
+    """Whether a cached file still has its recorded size and, if `verify`,
+    its recorded content hash."""
+    if not file_path.exists() or file_path.stat().st_size != entry.size:
+        return False
+    # entries adopted without hashing have no recorded hash
+    return not verify or not entry.sha256 or _file_sha256(file_path) == entry.sha256
+
 
-            # Download the file
-            with open(file_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        file.write(chunk)
-                    
+def _content_range_size(content_range: str | None) -> int:
+    """Total size from a `Content-Range: bytes a-b/size` header, or -1."""
+    if content_range is None:
+        return -1
+    total = content_range.rpartition('/')[2]
+    return int(total) if total.isdigit() else -1
 
-        
 
-        return file_path
\ No newline at end of file
+def _file_sha256(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
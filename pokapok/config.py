@@ -1,12 +1,193 @@
 from pathlib import Path
+import threading
+
+import requests
+
+from .session import new_session
+
+
+DASK_SCHEDULERS = ('synchronous', 'threads', 'processes', 'distributed')
 
 
 class Config:
 
     cache_dir: Path | None
 
-    def __init__(self, cache_dir: str|Path|None = None):
+    cache_ttl: float | None
+    """Seconds during which cached files are used without checking the server
+    (`None` to never check again)."""
+
+    listing_ttl: float | None
+    """Seconds during which parsed directory listings are used without
+    checking the server (`None` to never check again)."""
+
+    download_workers: int
+    """Maximum number of files downloaded concurrently."""
+
+    download_host_connections: int
+    """Maximum number of concurrent downloads from a single host."""
+
+    download_segments: int
+    """Number of byte ranges fetched in parallel for large files."""
+
+    download_segment_min_size: int
+    """Size (in bytes) from which files are fetched as parallel byte ranges."""
+
+    http_pool_size: int
+    """Maximum number of keep-alive HTTP connections per host."""
+
+    argo_chunks: dict[str, int] | None
+    """Chunk sizes by dimension (e.g. `{'N_PROF': 256}`) of lazily aggregated
+    Argo datasets. Defaults to one chunk per profile file."""
+
+    dask_scheduler: str
+    """Dask scheduler used to read Argo files: `'synchronous'`, `'threads'`,
+    `'processes'` or `'distributed'` (a `dask.distributed` local cluster)."""
+
+    dask_workers: int | None
+    """Number of dask workers. Defaults to the number of CPUs."""
+
+    dask_partition_size: int
+    """Number of Argo files read by each dask task."""
+
+    decode_workers: int
+    """Number of threads scanning the headers of Argo files while the next
+    ones download."""
+
+    pipeline_queue_size: int
+    """Maximum number of Argo files downloaded and scanned ahead of the
+    aggregation."""
+
+    argo_store_aggregates: bool
+    """Whether to keep aggregated Argo datasets in the cache directory, and
+    only append new cycles to them."""
+
+    woa23_url: str
+    """Base URL of the THREDDS server hosting the World Ocean Atlas 2023."""
+
+    woa23_subset: bool
+    """Whether to download only the requested region of WOA23 files, through
+    the THREDDS NetCDF Subset Service, when coordinates are given."""
+
+    woa23_chunks: dict[str, int]
+    """Dask chunk sizes by dimension of opened WOA23 datasets. Dimensions not
+    given are not split. Defaults to one chunk per depth level."""
+
+    woa23_zarr: bool
+    """Whether to transcode downloaded WOA23 files to Zarr stores in the cache
+    directory, and read them from there."""
+
+    woa23_zarr_chunks: dict[str, int]
+    """Chunk sizes by dimension of the WOA23 Zarr stores (spatial tiles by
+    depth blocks)."""
+
+    dataset_cache_size: int
+    """Maximum number of opened WOA23 datasets kept in memory."""
+
+    dataset_cache_bytes: int | None
+    """Maximum total size (in bytes, once loaded) of the opened WOA23
+    datasets kept in memory (`None` for no limit)."""
+
+    def __init__(self,
+            cache_dir: str|Path|None = None,
+            cache_ttl: float|None = 24 * 3600,
+            listing_ttl: float|None = 3600,
+            download_workers: int = 8,
+            download_host_connections: int = 4,
+            download_segments: int = 4,
+            download_segment_min_size: int = 64 << 20,
+            http_pool_size: int = 10,
+            argo_chunks: dict[str, int] | None = None,
+            dask_scheduler: str = 'threads',
+            dask_workers: int | None = None,
+            dask_partition_size: int = 8,
+            decode_workers: int = 4,
+            pipeline_queue_size: int = 16,
+            argo_store_aggregates: bool = True,
+            woa23_url: str = 'https://www.ncei.noaa.gov/thredds-ocean',
+            woa23_subset: bool = True,
+            woa23_chunks: dict[str, int] | None = None,
+            woa23_zarr: bool = False,
+            woa23_zarr_chunks: dict[str, int] | None = None,
+            dataset_cache_size: int = 16,
+            dataset_cache_bytes: int | None = 4 << 30):
+        if dask_scheduler not in DASK_SCHEDULERS:
+            raise Exception(f'unknown dask scheduler {dask_scheduler!r}, expected one of {DASK_SCHEDULERS}')
         if cache_dir is None:
             self.cache_dir = None
         else:
             self.cache_dir = Path(cache_dir)
+        self.cache_ttl = cache_ttl
+        self.listing_ttl = listing_ttl
+        self.download_workers = download_workers
+        self.download_host_connections = download_host_connections
+        self.download_segments = download_segments
+        self.download_segment_min_size = download_segment_min_size
+        self.http_pool_size = http_pool_size
+        self.argo_chunks = argo_chunks
+        self.dask_scheduler = dask_scheduler
+        self.dask_workers = dask_workers
+        self.dask_partition_size = dask_partition_size
+        self.decode_workers = decode_workers
+        self.pipeline_queue_size = pipeline_queue_size
+        self.argo_store_aggregates = argo_store_aggregates
+        self.woa23_url = woa23_url.rstrip('/')
+        self.woa23_subset = woa23_subset
+        self.woa23_chunks = {'depth': 1} if woa23_chunks is None else woa23_chunks
+        self.woa23_zarr = woa23_zarr
+        self.woa23_zarr_chunks = {'depth': 8, 'lat': 180, 'lon': 180} if woa23_zarr_chunks is None else woa23_zarr_chunks
+        self.dataset_cache_size = dataset_cache_size
+        self.dataset_cache_bytes = dataset_cache_bytes
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._dask_client = None
+        self._dask_client_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """HTTP session shared by every request made with this configuration."""
+        with self._session_lock:
+            if self._session is None:
+                self._session = new_session(self.http_pool_size)
+            return self._session
+
+    @property
+    def dask_options(self) -> dict:
+        """Keyword arguments to dask's `compute` for the configured scheduler."""
+        if self.dask_scheduler == 'distributed':
+            return {'scheduler': self._distributed_client()}
+        options = {'scheduler': self.dask_scheduler}
+        if self.dask_workers is not None and self.dask_scheduler != 'synchronous':
+            options['num_workers'] = self.dask_workers
+        return options
+
+    def close(self):
+        """Shut down the local cluster of the distributed scheduler, if it was
+        started, and close the HTTP session."""
+        with self._dask_client_lock:
+            client, self._dask_client = self._dask_client, None
+        if client is not None:
+            cluster = client.cluster
+            client.close()
+            if cluster is not None:
+                cluster.close()
+        with self._session_lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def __enter__(self) -> 'Config':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _distributed_client(self):
+        with self._dask_client_lock:
+            if self._dask_client is None:
+                try:
+                    from dask.distributed import Client, LocalCluster
+                except ImportError:
+                    raise Exception('the distributed dask scheduler requires the `distributed` package')
+                self._dask_client = Client(LocalCluster(n_workers=self.dask_workers))
+            return self._dask_client
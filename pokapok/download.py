@@ -0,0 +1,169 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import threading
+from time import sleep
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+from urllib.parse import urlparse
+
+
+# Get the logger for the library (it will use the root logger by default)
+logger = logging.getLogger("qcv_ingester_log")
+
+
+class RetryPolicy(NamedTuple):
+    """How the scheduler retries a failed download."""
+
+    attempts: int = 3
+    """Maximum number of attempts per URL."""
+    wait: float = 40.
+    """Number of seconds between attempts, waited without holding a
+    connection to the host."""
+    exceptions: tuple[type[BaseException], ...] = (OSError,)
+    """Errors that are retried (`requests` errors are `OSError`s)."""
+    skip: bool = False
+    """If `True`, a URL whose last attempt failed gives `None` instead of
+    raising the error."""
+
+
+class DownloadScheduler():
+    """
+    Bounded pool of download workers.
+
+    Downloads run concurrently on a thread pool, with at most
+    `max_per_host` simultaneous connections to any single host. Results are
+    always returned in the order in which the URLs were given.
+    """
+
+    def __init__(self, max_workers: int = 8, max_per_host: int = 4):
+        """
+        Bounded pool of download workers.
+
+        Args:
+            max_workers: Maximum number of concurrent downloads.
+            max_per_host: Maximum number of concurrent downloads from the same host.
+        """
+        if max_workers < 1:
+            raise Exception('max_workers must be at least 1')
+        if max_per_host < 1:
+            raise Exception('max_per_host must be at least 1')
+        self._max_workers = max_workers
+        self._max_per_host = max_per_host
+        self._hosts: dict[str, threading.BoundedSemaphore] = {}
+        self._hosts_lock = threading.Lock()
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @property
+    def max_per_host(self) -> int:
+        return self._max_per_host
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self._max_per_host)
+                self._hosts[host] = slot
+            return slot
+
+    @contextmanager
+    def extra_connections(self, url: str, n: int) -> Iterator[int]:
+        """
+        Reserve up to `n` more connections to the host of a URL, e.g. for the
+        byte ranges of a segmented download, on top of the one held by the
+        running download.
+
+        Connections are only taken if available, without waiting for other
+        downloads to finish, so downloads never wait on each other.
+
+        Args:
+            url: URL of the file being downloaded.
+            n: Maximum number of extra connections.
+
+        Returns:
+            The number of connections reserved until the context exits.
+        """
+        slot = self._host_slot(url)
+        reserved = 0
+        try:
+            while reserved < n and slot.acquire(blocking=False):
+                reserved += 1
+            yield reserved
+        finally:
+            for _ in range(reserved):
+                slot.release()
+
+    def _run(self, func: Callable[..., Any], url: str, kwargs: dict[str, Any],
+             retry: RetryPolicy | None = None) -> Any:
+        if retry is None:
+            with self._host_slot(url):
+                return func(url, **kwargs)
+        for attempt in range(1, retry.attempts + 1):
+            try:
+                with self._host_slot(url):
+                    return func(url, **kwargs)
+            except Exception as e:
+                if isinstance(e, retry.exceptions) and attempt < retry.attempts:
+                    logger.error(f"Attempt {attempt} failed for {url} - Error: {e}")
+                    logger.info(f"Retrying in {retry.wait} seconds... (Attempt {attempt + 1}/{retry.attempts})")
+                    # the host slot is released while waiting
+                    sleep(retry.wait)
+                    continue
+                if not retry.skip:
+                    raise
+                logger.error(f"Failed to download {url} after {attempt} attempts: {e}")
+                return None
+
+    def imap(self,
+            func: Callable[..., Any],
+            urls: Iterable[str],
+            retry: RetryPolicy | None = None,
+            **kwargs) -> Iterator[Any]:
+        """
+        Lazily apply a download function to URLs, yielding results in order.
+
+        At most twice `max_workers` downloads are queued ahead of the consumer,
+        so memory stays bounded when the caller processes results as they come.
+
+        Args:
+            func: Function called as `func(url, **kwargs)` for each URL.
+            urls: URLs to download.
+            retry: How failed calls are retried. By default they are not.
+            kwargs: Extra keyword arguments passed to `func`.
+        """
+        window = 2 * self._max_workers
+        pending: deque[Future] = deque()
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            try:
+                for url in urls:
+                    pending.append(pool.submit(self._run, func, url, kwargs, retry))
+                    if len(pending) >= window:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def map(self,
+            func: Callable[..., Any],
+            urls: Iterable[str],
+            retry: RetryPolicy | None = None,
+            **kwargs) -> list[Any]:
+        """
+        Apply a download function to URLs concurrently.
+
+        Args:
+            func: Function called as `func(url, **kwargs)` for each URL.
+            urls: URLs to download.
+            retry: How failed calls are retried. By default they are not.
+            kwargs: Extra keyword arguments passed to `func`.
+
+        Returns:
+            The results of `func`, in the same order as `urls`.
+        """
+        return list(self.imap(func, urls, retry, **kwargs))
@@ -0,0 +1,173 @@
+import hashlib
+import json
+from pathlib import Path
+import threading
+from time import time
+from typing import NamedTuple
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+import requests
+
+from .cache import atomic_path
+
+
+LISTINGS_DIR = 'listings'
+"""Sub-directory of the cache directory where parsed listings are stored."""
+
+
+class ListingEntry(NamedTuple):
+    """File in a web directory listing."""
+
+    name: str
+    url: str
+    last_modified: str | None
+    """Modification date as displayed in the listing."""
+    size: str | None
+    """Size as displayed in the listing (e.g. `12K`)."""
+
+
+def parse_listing(url: str, html: str | bytes, directories: bool = False) -> list[ListingEntry]:
+    """
+    Parse the files of an Apache or nginx style directory listing.
+
+    Sorting links and the parent directory link are skipped, and so are
+    sub-directories unless `directories`.
+
+    Args:
+        url: URL of the listing, used to resolve file links.
+        html: Content of the listing page.
+        directories: Whether to include sub-directories, named with a trailing `/`.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    entries = []
+    for link in soup.find_all('a'):
+        name = link.text
+        if link.get('href') != name or (name.endswith('/') and not directories):
+            continue
+        last_modified = size = None
+        cell = link.find_parent('td')
+        if cell is not None:
+            # table layout: name, last modified, size
+            cells = [td.get_text().strip() for td in cell.find_next_siblings('td')]
+            if len(cells) > 0:
+                last_modified = cells[0] or None
+            if len(cells) > 1:
+                size = cells[1] or None
+        elif isinstance(link.next_sibling, str):
+            # preformatted layout: "name  date time  size"
+            fields = link.next_sibling.split('\n', 1)[0].split()
+            if len(fields) >= 2:
+                last_modified = f'{fields[0]} {fields[1]}'
+            if len(fields) >= 3:
+                size = fields[2]
+        entries.append(ListingEntry(name, urljoin(url, name), last_modified, size))
+    return entries
+
+
+class ListingCache():
+    """
+    Parsed web directory listings, kept in memory and in the cache directory.
+
+    Listings fetched less than `ttl` seconds ago are served without any
+    request; older ones are revalidated with a conditional request.
+    Sub-directories are kept in the parsed listings, but only returned on
+    request.
+    """
+
+    def __init__(self,
+            session: requests.Session,
+            cache_dir: str | Path | None = None,
+            ttl: float | None = None):
+        """
+        Parsed web directory listings, kept in memory and in the cache directory.
+
+        Args:
+            session: HTTP session used to fetch listings.
+            cache_dir: Cache directory where to store listings. Listings are
+                only kept in memory if not given.
+            ttl: Number of seconds during which a listing is used without
+                checking the server. `None` means listings never expire.
+        """
+        self._session = session
+        self._dir = None if cache_dir is None else Path(cache_dir).joinpath(LISTINGS_DIR)
+        self._ttl = ttl
+        self._listings: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _file_path(self, url: str) -> Path | None:
+        if self._dir is None:
+            return None
+        return self._dir.joinpath(hashlib.sha1(url.encode()).hexdigest() + '.json')
+
+    def _load(self, url: str) -> dict | None:
+        with self._lock:
+            listing = self._listings.get(url)
+        if listing is not None:
+            return listing
+        file_path = self._file_path(url)
+        if file_path is None or not file_path.exists():
+            return None
+        try:
+            with open(file_path) as file:
+                listing = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if listing.get('url') != url:
+            return None
+        with self._lock:
+            self._listings[url] = listing
+        return listing
+
+    def _store(self, url: str, listing: dict):
+        with self._lock:
+            self._listings[url] = listing
+        file_path = self._file_path(url)
+        if file_path is None:
+            return
+        with atomic_path(file_path) as tmp_path, open(tmp_path, 'w') as file:
+            json.dump(listing, file)
+
+    def get(self, url: str, refresh: bool = False, directories: bool = False) -> list[ListingEntry]:
+        """
+        Files in a web directory listing.
+
+        Args:
+            url: URL of the directory listing.
+            refresh: If `True`, check the server even if the listing has not expired.
+            directories: Whether to include sub-directories, named with a trailing `/`.
+        """
+        def entries(listing: dict) -> list[ListingEntry]:
+            return [ListingEntry(*e) for e in listing['entries'] if directories or not e[0].endswith('/')]
+
+        listing = self._load(url)
+        if listing is not None and not listing.get('directories'):
+            # parsed without its sub-directories
+            listing = None
+        if listing is not None and not refresh and \
+                (self._ttl is None or time() - listing['checked_at'] < self._ttl):
+            return entries(listing)
+
+        headers = {}
+        if listing is not None:
+            if listing.get('etag'):
+                headers['If-None-Match'] = listing['etag']
+            if listing.get('last_modified'):
+                headers['If-Modified-Since'] = listing['last_modified']
+
+        checked_at = time()
+        response = self._session.get(url, headers=headers)
+        if listing is not None and response.status_code == 304:
+            listing = listing | {'checked_at': checked_at}
+        else:
+            response.raise_for_status()
+            listing = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'checked_at': checked_at,
+                'directories': True,
+                'entries': [list(e) for e in parse_listing(url, response.content, directories=True)],
+            }
+        self._store(url, listing)
+        return entries(listing)
@@ -0,0 +1,83 @@
+from contextlib import closing
+from pathlib import Path
+import sqlite3
+from typing import NamedTuple
+
+
+MANIFEST_FILENAME = '.pokapok-manifest.sqlite'
+
+
+class ManifestEntry(NamedTuple):
+    """Record of a file downloaded into a cache directory."""
+
+    url: str
+    path: str
+    """Path of the file, relative to the cache directory."""
+    size: int
+    etag: str | None
+    last_modified: str | None
+    sha256: str
+    checked_at: float
+    """Time (seconds since the epoch) of the last check against the server."""
+
+
+class Manifest():
+    """
+    On-disk record of the files downloaded into a cache directory.
+
+    Entries are stored in an SQLite database at the root of the cache
+    directory, so they are shared by every process using that directory.
+    """
+
+    def __init__(self, dir: str | Path):
+        """
+        On-disk record of the files downloaded into a cache directory.
+
+        Args:
+            dir: Path to the cache directory.
+        """
+        self._path = Path(dir).joinpath(MANIFEST_FILENAME)
+        with closing(self._connect()) as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                url TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                sha256 TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                PRIMARY KEY (url, path)
+            )''')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self._path, timeout=60)
+
+    def get(self, url: str, path: str) -> ManifestEntry | None:
+        """Entry for a URL downloaded to a path, if any."""
+        with closing(self._connect()) as db:
+            row = db.execute(
+                'SELECT * FROM entries WHERE url = ? AND path = ?',
+                (url, path)).fetchone()
+        return None if row is None else ManifestEntry(*row)
+
+    def put(self, entry: ManifestEntry):
+        """Add or replace an entry."""
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                tuple(entry))
+
+    def touch(self, url: str, path: str, checked_at: float):
+        """Record that an entry was successfully checked against the server."""
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'UPDATE entries SET checked_at = ? WHERE url = ? AND path = ?',
+                (checked_at, url, path))
+
+    def remove(self, url: str, path: str):
+        """Remove an entry."""
+        with closing(self._connect()) as db, db:
+            db.execute(
+                'DELETE FROM entries WHERE url = ? AND path = ?',
+                (url, path))
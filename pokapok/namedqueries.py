@@ -75,6 +75,7 @@ QueryName = Literal[
     'urn:pokapok:udal:argo:files',
     'urn:pokapok:udal:woa23',
     'urn:pokapok:udal:woa23:files',
+    'urn:pokapok:udal:woa23:sample',
     ]
 
 
@@ -85,10 +86,17 @@ QUERY_REGISTRY : dict[QueryName, NamedQueryInfo] = {
     'urn:pokapok:udal:argo:list': NamedQueryInfo(
             'urn:pokapok:udal:argo:list',
             [
+                TypedValue('dac', 'str|List[str]|None'),
                 TypedValue('float_mode', 'FloatMode|list[FloatMode]|None'),
                 TypedValue('float_type', 'FloatType|list[FloatType]|None'),
                 TypedValue('float', 'str|List[str]'),
                 TypedValue('descending_cycles', 'bool'),
+                TypedValue('lat_max', 'float'),
+                TypedValue('lat_min', 'float'),
+                TypedValue('lon_max', 'float'),
+                TypedValue('lon_min', 'float'),
+                TypedValue('time_max', 'datetime|str'),
+                TypedValue('time_min', 'datetime|str'),
             ],
             [],
         ),
@@ -107,6 +115,17 @@ QUERY_REGISTRY : dict[QueryName, NamedQueryInfo] = {
                 TypedValue('float_type', 'FloatType|list[FloatType]|None'),
                 TypedValue('float', 'str'),
                 TypedValue('descending_cycles', 'bool'),
+                TypedValue('layout', "Literal['dense', 'ragged']"),
+                TypedValue('lazy', 'bool'),
+                TypedValue('chunks', 'dict[str, int]|None'),
+                TypedValue('levels', 'ArrayLike|None'),
+                TypedValue('level_variable', 'str'),
+                TypedValue('qc_flags', 'int|str|list[int|str]|None'),
+                TypedValue('data_mode', 'str|list[str]|None'),
+                TypedValue('prefer_adjusted', 'bool'),
+                TypedValue('stream', 'bool'),
+                TypedValue('sync', 'bool'),
+                TypedValue('since', 'datetime|str|None'),
             ],
             [],
         ),
@@ -120,29 +139,57 @@ QUERY_REGISTRY : dict[QueryName, NamedQueryInfo] = {
                 TypedValue('descending_cycles', 'bool'),
                 TypedValue('incl_meta', 'bool'),
                 TypedValue('bypass_out_arch_building', 'bool'),
+                TypedValue('stream', 'bool'),
+                TypedValue('sync', 'bool'),
+                TypedValue('since', 'datetime|str|None'),
             ],
             [],
         ),
     'urn:pokapok:udal:woa23': NamedQueryInfo(
             'urn:pokapok:udal:woa23',
             [
-                TypedValue('decade', 'Decade'),
+                TypedValue('decade', 'Decade|list[Decade]'),
+                TypedValue('depth_max', 'float'),
+                TypedValue('depth_min', 'float'),
+                TypedValue('fields', 'str|list[str]|None'),
                 TypedValue('grid', 'float'),
                 TypedValue('lat_max', 'float'),
                 TypedValue('lat_min', 'float'),
                 TypedValue('lon_max', 'float'),
                 TypedValue('lon_min', 'float'),
-                TypedValue('time_res', 'TimeRes'),
-                TypedValue('variable', 'Variable'),
+                TypedValue('time_res', 'TimeRes|list[TimeRes]'),
+                TypedValue('variable', 'Variable|list[Variable]'),
             ],
             [],
         ),
     'urn:pokapok:udal:woa23:files': NamedQueryInfo(
             'urn:pokapok:udal:woa23:files',
+            [
+                TypedValue('decade', 'Decade|list[Decade]'),
+                TypedValue('depth_max', 'float'),
+                TypedValue('depth_min', 'float'),
+                TypedValue('fields', 'str|list[str]|None'),
+                TypedValue('grid', 'float'),
+                TypedValue('lat_max', 'float'),
+                TypedValue('lat_min', 'float'),
+                TypedValue('lon_max', 'float'),
+                TypedValue('lon_min', 'float'),
+                TypedValue('time_res', 'TimeRes|list[TimeRes]'),
+                TypedValue('variable', 'Variable|list[Variable]'),
+            ],
+            [],
+        ),
+    'urn:pokapok:udal:woa23:sample': NamedQueryInfo(
+            'urn:pokapok:udal:woa23:sample',
             [
                 TypedValue('decade', 'Decade'),
+                TypedValue('depth', 'ArrayLike'),
+                TypedValue('field', 'str'),
                 TypedValue('grid', 'float'),
-                TypedValue('time_res', 'TimeRes'),
+                TypedValue('lat', 'ArrayLike'),
+                TypedValue('lon', 'ArrayLike'),
+                TypedValue('method', "Literal['nearest', 'linear']"),
+                TypedValue('time_res', 'TimeRes|int|list[TimeRes|int]'),
                 TypedValue('variable', 'Variable'),
             ],
             [],
@@ -0,0 +1,37 @@
+import threading
+
+
+class NetCDFLock():
+    """
+    Lock serializing every access to netCDF files within a process.
+
+    The netCDF and HDF5 libraries are not thread-safe, and files are opened
+    and read by several threads (downloads pipeline, dask). The lock is
+    passed as `lock` to `xarray.open_dataset`, so the reads of lazy arrays
+    hold it too. It is reentrant, so files may be opened and read while
+    holding it, and it pickles as a reference to `NETCDF_LOCK`, so each dask
+    worker process uses its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __reduce__(self):
+        return 'NETCDF_LOCK'
+
+
+NETCDF_LOCK = NetCDFLock()
+"""Lock shared by the netCDF accesses of every broker."""
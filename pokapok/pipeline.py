@@ -0,0 +1,74 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator
+
+
+_DONE = object()
+
+
+def pipelined(func: Callable[[Any], Any],
+        items: Iterable[Any],
+        workers: int = 4,
+        maxsize: int = 16) -> Iterator[Any]:
+    """
+    Lazily apply a function to items while they are still being produced,
+    yielding results in order.
+
+    `items` is consumed by a feeder thread, and `func` runs on a thread pool
+    as soon as each item is available, so the production of the next items
+    (e.g. downloads) overlaps with the processing of the previous ones
+    (e.g. decoding). The stages are connected by a queue of at most
+    `maxsize` items: when the consumer falls behind, the feeder stops
+    pulling items, so memory stays bounded.
+
+    Args:
+        func: Function applied to each item.
+        items: Items to process, possibly a lazy iterator.
+        workers: Number of threads running `func`.
+        maxsize: Maximum number of items processed ahead of the consumer.
+    """
+    if workers < 1:
+        raise Exception('workers must be at least 1')
+    if maxsize < 1:
+        raise Exception('maxsize must be at least 1')
+    pending: queue.Queue = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(value) -> bool:
+        while not stop.is_set():
+            try:
+                pending.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def feed(pool: ThreadPoolExecutor):
+        try:
+            for item in items:
+                if not put(pool.submit(func, item)):
+                    return
+        except BaseException as e:
+            # raised to the consumer once the previous items are processed
+            failed: Future = Future()
+            failed.set_exception(e)
+            put(failed)
+        put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        feeder = threading.Thread(target=feed, args=(pool,), daemon=True)
+        feeder.start()
+        try:
+            while (future := pending.get()) is not _DONE:
+                yield future.result()
+        finally:
+            stop.set()
+            while True:
+                try:
+                    future = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if future is not _DONE:
+                    future.cancel()
+            feeder.join()
@@ -1,5 +1,5 @@
 import pandas
-from typing import Any
+from typing import Any, Callable, Iterator
 
 # import udal.specification as udal
 
@@ -12,10 +12,16 @@ class Result():
 
     Type = pandas.DataFrame
 
-    def __init__(self, query: NamedQueryInfo, data: Any, metadata: dict = {}):
+    def __init__(self,
+            query: NamedQueryInfo,
+            data: Any = None,
+            metadata: dict = {},
+            batches: Callable[[int], Iterator] | None = None):
         self._query = query
         self._data = data
         self._metadata = metadata
+        self._batches = batches
+        self._streamed = data is None and batches is not None
 
     @property
     def query(self):
@@ -30,6 +36,15 @@ class Result():
 
     def data(self, type: type[Type] | None = None) -> Type:
         """The data of the result."""
+        if self._streamed:
+            raise Exception('streamed result, use iter_batches')
         if type is None or type is pandas.DataFrame:
             return self._data
         raise Exception(f'type "{type}" not supported')
+
+    def iter_batches(self, n: int = 64) -> Iterator:
+        """The data of the result in batches of `n` items, each produced as
+        soon as its items are available."""
+        if self._batches is None:
+            raise Exception('result cannot be streamed')
+        return self._batches(n)
@@ -0,0 +1,16 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def new_session(pool_size: int = 10) -> requests.Session:
+    """
+    HTTP session with pooled keep-alive connections.
+
+    Args:
+        pool_size: Maximum number of connections kept alive for each host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
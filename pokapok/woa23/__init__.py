@@ -1,6 +1,7 @@
 """World Ocean Atlas 2023 data access."""
 
 __all__ = [
+    'sample',
     'types',
     'udal',
 ]
@@ -0,0 +1,80 @@
+from typing import Literal
+
+import numpy
+from scipy.interpolate import RegularGridInterpolator
+import xarray
+
+
+SampleMethod = Literal['nearest', 'linear']
+
+
+def sample_field(
+        field: xarray.DataArray,
+        lon: numpy.ndarray,
+        lat: numpy.ndarray,
+        depth: numpy.ndarray,
+        method: SampleMethod = 'linear') -> numpy.ndarray:
+    """
+    Values of a gridded WOA23 field at arbitrary points, interpolated in a
+    single vectorized call.
+
+    Longitudes are taken modulo 360 and, on global grids, the first and last
+    columns are repeated across the antimeridian so points between them are
+    interpolated too. Latitudes beyond the outermost cell centres are clamped
+    to them. Points below the deepest level, on land, or (with `linear`)
+    next to land are NaN.
+
+    Args:
+        field: Field with `depth`, `lat` and `lon` dimensions, in ascending order.
+        lon: Longitude of each point.
+        lat: Latitude of each point.
+        depth: Depth of each point.
+        method: `nearest` cell value, or trilinear interpolation.
+
+    Returns:
+        The value of the field at each point.
+    """
+    lons = field['lon'].values
+    lats = field['lat'].values
+    depths = field['depth'].values
+
+    # only the levels and rows around the points are read
+    depth_slice = _bracket(depths, depth)
+    lat_slice = _bracket(lats, lat)
+    field = field.isel(depth=depth_slice, lat=lat_slice)
+    depths, lats = depths[depth_slice], lats[lat_slice]
+    values = numpy.asarray(field.transpose('depth', 'lat', 'lon').values, dtype='f8')
+
+    lon = numpy.asarray(lon, dtype='f8')
+    step = lons[1] - lons[0] if len(lons) > 1 else 360.
+    if len(lons) * step >= 360. - step / 2:
+        lons = numpy.concatenate([lons[-1:] - 360., lons, lons[:1] + 360.])
+        values = numpy.concatenate([values[..., -1:], values, values[..., :1]], axis=-1)
+    lon = (lon - lons[0]) % 360. + lons[0]
+    lat = numpy.clip(lat, lats[0], lats[-1])
+    depth = numpy.maximum(depth, depths[0])
+
+    if len(depths) == 1:
+        # a single level cannot be interpolated along: keep it for its own depth only
+        values = values[0]
+        grid: tuple = (lats, lons)
+        points = numpy.stack([lat, lon], axis=-1)
+    else:
+        grid = (depths, lats, lons)
+        points = numpy.stack([depth, lat, lon], axis=-1)
+    interpolator = RegularGridInterpolator(grid, values, method=method, bounds_error=False, fill_value=numpy.nan)
+    sampled = interpolator(points)
+    if len(depths) == 1:
+        sampled[depth > depths[0]] = numpy.nan
+    return sampled
+
+
+def _bracket(coords: numpy.ndarray, values: numpy.ndarray) -> slice:
+    """Smallest slice of ascending coordinates enclosing every finite value."""
+    values = numpy.asarray(values, dtype='f8')
+    finite = values[numpy.isfinite(values)]
+    if finite.size == 0:
+        return slice(0, 1)
+    start = max(int(numpy.searchsorted(coords, finite.min(), side='right')) - 1, 0)
+    stop = min(int(numpy.searchsorted(coords, finite.max(), side='left')) + 1, len(coords))
+    return slice(start, max(stop, start + 1))
@@ -1,21 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import numpy
+import pandas
 from pathlib import Path
 import os.path
+import re
+import shutil
 import tempfile
 import requests
-from typing import Any, List
+from typing import Any, Callable, List
+from urllib.parse import urlencode
 import xarray
 
 from ..broker import Broker
-from ..cache import Directory
+from ..cache import DatasetCache, Directory, atomic_path
 from ..config import Config
+from ..download import DownloadScheduler
 from ..namedqueries import NamedQueryInfo, QueryName, QUERY_NAMES, QUERY_REGISTRY
+from ..netcdf import NETCDF_LOCK
 from ..result import Result
+from .sample import sample_field
 from .types import Decade, TimeRes, Variable, SpatialRes
 
+import logging
+# Get the logger for the library (it will use the root logger by default)
+logger = logging.getLogger("qcv_ingester_log")
+
 
 localBrokerQueryNames: List[QueryName] = [
     'urn:pokapok:udal:woa23',
     'urn:pokapok:udal:woa23:files',
+    'urn:pokapok:udal:woa23:sample',
 ]
 
 
@@ -23,9 +38,23 @@ localBrokerQueries: dict[QueryName, NamedQueryInfo] = \
     { k: v for k, v in QUERY_REGISTRY.items() if k in localBrokerQueryNames }
 
 
+SUBSETS_DIR = 'subsets'
+"""Sub-directory of a variable's directory where regional subsets are stored."""
+
+STACKED_PARAMS = ('variable', 'decade', 'time_res')
+"""Parameters that may be lists, to stack the files along new dimensions."""
+
+ZARR_SUFFIX = '.zarr'
+"""Suffix of the Zarr transcodings of WOA23 files, named after the file
+with its size and modification time, so a downloaded file that changed gets
+a new store and the previous one is never replaced while it may be open."""
+
+
 class WOA23Broker(Broker):
 
     _config: Config
+    _downloader: DownloadScheduler
+    _datasets: DatasetCache | None
 
     _query_names: List[QueryName] = localBrokerQueryNames
 
@@ -33,6 +62,11 @@ class WOA23Broker(Broker):
 
     def __init__(self, config: Config):
         self._config = config
+        self._downloader = DownloadScheduler(config.download_workers, config.download_host_connections)
+        # files in a temporary directory do not outlive the query
+        self._datasets = None
+        if config.cache_dir is not None:
+            self._datasets = DatasetCache(config.dataset_cache_size, config.dataset_cache_bytes)
 
     @property
     def queryNames(self) -> List[str]:
@@ -42,7 +76,84 @@ class WOA23Broker(Broker):
     def queries(self) -> List[NamedQueryInfo]:
         return list(WOA23Broker._queries.values())
 
+    def _download_subset(self,
+            dir: Directory,
+            data_path: str,
+            path: str | Path,
+            lon_min: float,
+            lon_max: float,
+            lat_min: float,
+            lat_max: float,
+            fields: tuple[str, ...] | None = None) -> Path | None:
+        """Download the region of a WOA23 file through the THREDDS NetCDF
+        Subset Service, or `None` if the service failed."""
+        query = urlencode({
+            'var': 'all' if fields is None else ','.join(fields),
+            'north': lat_max,
+            'south': lat_min,
+            'west': lon_min,
+            'east': lon_max,
+            'horizStride': 1,
+            'accept': 'netcdf',
+        })
+        url = f'{self._config.woa23_url}/ncss/grid/{data_path}?{query}'
+        filename = f'{Path(data_path).stem}_{lon_min:g}_{lon_max:g}_{lat_min:g}_{lat_max:g}'
+        if fields is not None:
+            filename += '_' + '-'.join(fields)
+        filename += '.nc'
+        try:
+            [file_path] = self._downloader.map(dir.download, [url], path=Path(path, SUBSETS_DIR),
+                                               mkdir=True, filename=filename)
+            return file_path
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"subset service failed for {data_path}, downloading the whole file: {e}")
+            return None
+
     def _execute_woa(self, params: dict[str, Any]):
+        """World Ocean Atlas 2023 Data, stacked along the `variable`, `decade`
+        and `time_res` parameters given as lists.
+
+        The files are fetched and opened concurrently. Stacked fields are
+        named without their variable prefix (e.g. `an` for `t_an`), and
+        depths are the union of the files' depths."""
+        stacked = {name: params[name] for name in STACKED_PARAMS if isinstance(params.get(name), list)}
+        if not stacked:
+            return self._execute_woa_file(params)
+
+        combinations = list(itertools.product(*stacked.values()))
+        with ThreadPoolExecutor(max_workers=self._config.download_workers) as pool:
+            datasets = list(pool.map(
+                lambda values: self._stackable_woa(params | dict(zip(stacked, values))), combinations))
+
+        def nest(items: list, shape: list[int]) -> list:
+            if len(shape) == 1:
+                return items
+            step = len(items) // shape[0]
+            return [nest(items[i * step:(i + 1) * step], shape[1:]) for i in range(shape[0])]
+
+        # fields are stacked, bounds and other grid variables are shared
+        fields = [v for v, array in datasets[0].data_vars.items() if {'lat', 'lon'} <= set(array.dims)]
+        dataset = xarray.combine_nested(
+            nest(datasets, [len(values) for values in stacked.values()]),
+            concat_dim=list(stacked),
+            data_vars=fields,
+            coords='minimal',
+            compat='override',
+            join='outer',
+            combine_attrs='drop_conflicts')
+        dataset = dataset.assign_coords({name: [v.value for v in values] for name, values in stacked.items()})
+        return dataset.transpose(*stacked, ...)
+
+    def _stackable_woa(self, params: dict[str, Any]) -> xarray.Dataset:
+        """Dataset of a single WOA23 file, without its time dimension and with
+        its fields named without the variable prefix."""
+        dataset = self._execute_woa_file(params)
+        if 'time' in dataset.dims:
+            dataset = dataset.squeeze('time', drop=True)
+        prefix = f"{params['variable'].short()}_"
+        return dataset.rename({v: v[len(prefix):] for v in dataset.data_vars if v.startswith(prefix)})
+
+    def _execute_woa_file(self, params: dict[str, Any]):
         """World Ocean Atlas 2023 Data
 
         https://www.ncei.noaa.gov/access/world-ocean-atlas-2023/"""
@@ -101,26 +212,191 @@ class WOA23Broker(Broker):
         if time_res is None:
             raise Exception('missing time_res')
 
+        # depth
+        depth_min: float | None = params.get('depth_min')
+        depth_max: float | None = params.get('depth_max')
+
+        # fields, e.g. `t_an` or `an` for the objectively analyzed temperature
+        fields: str | list[str] | None = params.get('fields')
+        if fields is not None:
+            if isinstance(fields, str):
+                fields = [fields]
+            prefix = f'{variable.short()}_'
+            fields = tuple(f if f.startswith(prefix) else prefix + f for f in fields)
+
         file_name = f'woa23_{decade.value}_{variable.short()}{time_res.value}_{file_grid_part}.nc'
-        url = f'https://www.ncei.noaa.gov/thredds-ocean/fileServer/woa23/DATA/{variable.value}/netcdf/{decade.value}/{grid.value:0.2f}/{file_name}'
+        data_path = f'woa23/DATA/{variable.value}/netcdf/{decade.value}/{grid.value:0.2f}/{file_name}'
+        url = f'{self._config.woa23_url}/fileServer/{data_path}'
 
         # It is important to create a sub-directory for each variable to avoid
         # conflicts in case-insensitive file systems.
-        with Directory(self._config.cache_dir) as dir:
+        if params.get('bypass_out_arch_building'):       
+            path=""
+        else:
+            path = Path('woa23').joinpath(variable.value)
 
-            if params.get('bypass_out_arch_building'):       
-                path=""
-            else:
-                path = Path('woa23').joinpath(variable.value)
+        # Repeated queries on the same file are served from the opened
+        # datasets, without checking the server again
+        key = (variable, decade, time_res, grid, str(path))
+        dataset = None if self._datasets is None else self._datasets.get(key)
+        # the subset service cannot wrap around the antimeridian
+        if dataset is None and self._config.woa23_subset and not all(coords_are_none) and lon_min <= lon_max:
+            box = (lon_min, lon_max, lat_min, lat_max)
+            dataset = self._cached(key + (box, fields), lambda: self._open_woa(url, data_path, path, box, fields))
+        if dataset is None:
+            dataset = self._cached(key, lambda: self._open_woa(url, data_path, path))
+
+        # Selections are lazy: only the requested hyperslab is read from disk
+        # once computed
+        if fields is not None:
+            missing = [f for f in fields if f not in dataset.data_vars]
+            if missing:
+                raise Exception(f'unknown fields {missing}')
+            prefix = f'{variable.short()}_'
+            dataset = dataset.drop_vars([v for v in dataset.data_vars if v.startswith(prefix) and v not in fields])
+        if depth_min is not None or depth_max is not None:
+            dataset = dataset.sel(depth=slice(depth_min, depth_max))
+        if all(coords_are_none):
+            # the cached dataset itself is shared by every query
+            return dataset.copy()
+        else:
+            return dataset.sel(lon=slice(lon_min, lon_max), lat=slice(lat_min, lat_max))
 
-            file_path = dir.download(url, path, mkdir=True)
-            dataset = xarray.open_dataset(file_path, decode_times=False)
-            
-            if all(coords_are_none):
-                return dataset
+    def _execute_woa_sample(self, params: dict[str, Any]) -> pandas.DataFrame:
+        """World Ocean Atlas 2023 field sampled at arbitrary points.
+
+        `lon`, `lat` and `depth` are broadcast against each other, and
+        `time_res` is either one for every point or one per point (months as
+        `TimeRes` or their number). Each file is opened once, and all of its
+        points are interpolated in a single vectorized call."""
+        variable: Variable | None = params.get('variable')
+        if variable is None:
+            raise Exception('missing variable')
+        try:
+            lon, lat, depth = numpy.broadcast_arrays(
+                *(numpy.asarray(params[name], dtype='f8') for name in ('lon', 'lat', 'depth')))
+        except KeyError as e:
+            raise Exception(f'missing {e.args[0]}')
+        except ValueError:
+            raise Exception('lon, lat and depth have incompatible shapes')
+        lon, lat, depth = lon.ravel(), lat.ravel(), depth.ravel()
+
+        method = params.get('method', 'linear')
+        if method not in ('nearest', 'linear'):
+            raise Exception('invalid method; supported values: nearest, linear')
+        field: str = params.get('field', 'an')
+        prefix = f'{variable.short()}_'
+        if not field.startswith(prefix):
+            field = prefix + field
+
+        time_res = params.get('time_res')
+        if time_res is None:
+            raise Exception('missing time_res')
+        if isinstance(time_res, (TimeRes, int, str)):
+            time_res = [time_res]
+        codes = numpy.array([
+            t.value if isinstance(t, TimeRes) else TimeRes(f'{int(t):02d}').value for t in time_res])
+        if len(codes) != 1 and len(codes) != len(lon):
+            raise Exception('time_res must be a single value or one per point')
+        codes = numpy.broadcast_to(codes, lon.shape)
+
+        values = numpy.full(lon.shape, numpy.nan)
+        file_params = {k: v for k, v in params.items()
+                       if k not in ('lon', 'lat', 'depth', 'method', 'field', 'time_res')}
+        for code in numpy.unique(codes):
+            selected = codes == code
+            dataset = self._execute_woa_file(file_params | {'time_res': TimeRes(code), 'fields': field})
+            array = dataset[field]
+            if 'time' in array.dims:
+                array = array.isel(time=0)
+            values[selected] = sample_field(
+                array, lon[selected], lat[selected], depth[selected], method)
+
+        return pandas.DataFrame({
+            'lon': lon,
+            'lat': lat,
+            'depth': depth,
+            'time_res': pandas.Categorical(codes),
+            field: values,
+        })
+
+    def _cached(self, key: tuple, open: Callable[[], xarray.Dataset | None]) -> xarray.Dataset | None:
+        if self._datasets is None:
+            return open()
+        return self._datasets.get_or_open(key, open)
+
+    def _open_woa(self,
+            url: str,
+            data_path: str,
+            path: str | Path,
+            box: tuple[float, float, float, float] | None = None,
+            fields: tuple[str, ...] | None = None) -> xarray.Dataset | None:
+        """Open a WOA23 file lazily, as dask arrays, or only its region within
+        `box` (`None` if the subset service failed)."""
+        with Directory.from_config(self._config, self._downloader) as dir:
+            if box is not None:
+                file_path = self._download_subset(dir, data_path, path, *box, fields)
+                if file_path is None:
+                    return None
             else:
-                return dataset.sel(lon=slice(lon_min, lon_max), lat=slice(lat_min, lat_max))
+                [file_path] = self._downloader.map(dir.download, [url], path=path, mkdir=True)
+                if self._config.woa23_zarr and self._config.cache_dir is not None:
+                    return self._open_zarr(dir, file_path)
+            # the netCDF library is not thread-safe: files are opened, and their
+            # chunks read, one at a time
+            with NETCDF_LOCK:
+                return xarray.open_dataset(file_path, decode_times=False, chunks=self._config.woa23_chunks,
+                                           lock=NETCDF_LOCK)
+
+    def _open_zarr(self, dir: Directory, file_path: Path) -> xarray.Dataset:
+        """Open the Zarr transcoding of a downloaded WOA23 file, transcoding
+        it first if missing.
+
+        Only the transcoding of the same file waits on the lock of its store,
+        other files are transcoded and opened meanwhile. Stores of previous
+        versions of the file are then deleted."""
+        try:
+            import zarr
+        except ImportError:
+            raise Exception('transcoding WOA23 files to Zarr requires the `zarr` package (the `zarr` extra)')
+
+        stat = file_path.stat()
+        store_path = file_path.with_name(f'{file_path.stem}.{stat.st_size}-{stat.st_mtime_ns}{ZARR_SUFFIX}')
+        if not store_path.exists():
+            with dir.lock(store_path):
+                # possibly transcoded by another worker while waiting for the lock
+                if not store_path.exists():
+                    self._transcode_zarr(file_path, store_path)
+                    self._remove_old_zarr(file_path, store_path)
+        dataset = xarray.open_zarr(store_path, decode_times=False)
+        dataset.encoding.setdefault('source', str(store_path))
+        return dataset
+
+    def _remove_old_zarr(self, file_path: Path, store_path: Path):
+        """Delete the Zarr stores of other versions of a WOA23 file, except
+        those of datasets still cached."""
+        pattern = re.compile(re.escape(file_path.stem) + r'\.\d+-\d+' + re.escape(ZARR_SUFFIX))
+        in_use = set() if self._datasets is None else {path.resolve() for path in self._datasets.sources()}
+        for path in file_path.parent.iterdir():
+            if pattern.fullmatch(path.name) and path != store_path and path.resolve() not in in_use:
+                logger.info(f"removing outdated Zarr store {path.name}")
+                shutil.rmtree(path, ignore_errors=True)
 
+    def _transcode_zarr(self, file_path: Path, store_path: Path):
+        """Write a WOA23 file to a Zarr store, chunked by `woa23_zarr_chunks`."""
+        logger.info(f"transcoding {file_path.name} to Zarr")
+        with NETCDF_LOCK:
+            dataset = xarray.open_dataset(file_path, decode_times=False, lock=NETCDF_LOCK)
+        with dataset:
+            chunks = {dim: size for dim, size in self._config.woa23_zarr_chunks.items() if dim in dataset.dims}
+            dataset = dataset.chunk(chunks)
+            for variable in dataset.variables.values():
+                # keep the chunks given above, not those of the netCDF file
+                variable.encoding.pop('chunksizes', None)
+                variable.encoding.pop('preferred_chunks', None)
+            # written aside then renamed, so readers never see a partial store
+            with atomic_path(store_path) as tmp_path:
+                dataset.to_zarr(tmp_path, mode='w', consolidated=True)
 
 
     def execute(self, qn: QueryName, params: dict[str, Any] | None = None) -> Result:
@@ -131,6 +407,8 @@ class WOA23Broker(Broker):
                 return Result(query, self._execute_woa(queryParams))
             case 'urn:pokapok:udal:woa23:files':
                 return Result(query, self._execute_woa(queryParams))
+            case 'urn:pokapok:udal:woa23:sample':
+                return Result(query, self._execute_woa_sample(queryParams))
             case _:
                 if qn in QUERY_NAMES:
                     raise Exception(f'unsupported query name "{qn}"')
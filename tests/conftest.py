@@ -0,0 +1,118 @@
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from typing import Callable
+
+import pytest
+
+
+class FileServer():
+    """
+    Local stand-in for the data servers, serving files from memory.
+
+    Files are served with an ETag and support range requests. Every request
+    is recorded, and the server can be told to misbehave: to drop the
+    connection partway through a file, to answer range requests with 416, or
+    to answer every path under a prefix with an error status. Paths under a
+    prefix can also be answered by a function, e.g. a subset service.
+    """
+
+    def __init__(self):
+        self.url = None
+        self.files: dict[str, bytes] = {}
+        self.requests: list[tuple[str, dict[str, str]]] = []
+        """Path and headers of each GET request, in order."""
+        self.truncate: dict[str, int] = {}
+        """Number of bytes of a file sent before dropping the connection, once."""
+        self.statuses: dict[str, int] = {}
+        """Status code answered to every path starting with a prefix."""
+        self.responders: dict[str, Callable[[str], bytes]] = {}
+        """Function giving the body answered to every path (with its query)
+        starting with a prefix."""
+        self.unsatisfiable_ranges = False
+        self.delay = 0.
+        self._lock = threading.Lock()
+
+    def gets(self, path: str) -> list[dict[str, str]]:
+        """Headers of the GET requests for a path."""
+        with self._lock:
+            return [headers for p, headers in self.requests if p == path]
+
+
+def _handler(server: FileServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send_empty(self, status: int, headers: dict[str, str] = {}):
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_GET(self):
+            with server._lock:
+                server.requests.append((self.path, dict(self.headers)))
+            time.sleep(server.delay)
+            for prefix, status in server.statuses.items():
+                if self.path.startswith(prefix):
+                    return self._send_empty(status)
+            for prefix, respond in server.responders.items():
+                if self.path.startswith(prefix):
+                    body = respond(self.path)
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+            data = server.files.get(self.path.split('?')[0])
+            if data is None:
+                return self._send_empty(404)
+
+            etag = '"' + hashlib.md5(data).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._send_empty(304, {'ETag': etag})
+            range = self.headers.get('Range')
+            if range is not None and self.headers.get('If-Range') in (None, etag):
+                if server.unsatisfiable_ranges:
+                    return self._send_empty(416, {'Content-Range': f'bytes */{len(data)}'})
+                start, end = range.removeprefix('bytes=').split('-')
+                start, end = int(start), int(end) if end else len(data) - 1
+                body = data[start:end + 1]
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{start + len(body) - 1}/{len(data)}')
+            else:
+                body = data
+                self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+
+            with server._lock:
+                truncate = server.truncate.pop(self.path, None)
+            if truncate is not None:
+                self.wfile.write(body[:truncate])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+    return Handler
+
+
+@pytest.fixture
+def http_server():
+    """Local HTTP file server, see `FileServer`."""
+    server = FileServer()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _handler(server))
+    server.url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    httpd.shutdown()
+    httpd.server_close()
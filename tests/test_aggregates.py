@@ -0,0 +1,42 @@
+import numpy as np
+import xarray as xr
+
+from pokapok.argo.aggregates import Aggregate, AggregateStore, FileStamp
+
+
+def test_save_and_load(tmp_path):
+    source = tmp_path / 'R6901580_001.nc'
+    source.write_bytes(b'profile')
+    dataset = xr.Dataset({
+        'PRES': (('N_PROF', 'N_LEVELS'), np.array([[10., 20.], [10., np.nan]])),
+        'DATA_MODE': ('N_PROF', np.array([b'R', np.nan], dtype=object)),
+    })
+    dataset['PRES'].attrs['valid_min'] = np.float32(0.)
+    dataset['PRES'].encoding = {'dtype': np.dtype('float32'), '_FillValue': np.float32(99999.)}
+    header = {
+        'sizes': {'N_PROF': 2, 'N_LEVELS': 2},
+        'attrs': {'title': 'Argo float vertical profile'},
+        'variables': {
+            'PRES': {'dims': ('N_PROF', 'N_LEVELS'), 'dtype': np.dtype('float32'),
+                     'attrs': {'valid_min': np.float32(0.), 'resolution': np.array([0.1, 1.])},
+                     'encoding': {'chunksizes': None, 'original_shape': (2, 2), '_FillValue': np.nan}},
+            'DATA_MODE': {'dims': ('N_PROF',), 'dtype': np.dtype('S1'),
+                          'attrs': {'conventions': b'R : real time'}, 'encoding': {}},
+        },
+    }
+    store = AggregateStore(tmp_path)
+    options = {'layout': 'dense'}
+    store.save('coriolis', '6901580', options, Aggregate([FileStamp.of(source)], [header], dataset))
+
+    aggregate = store.load('coriolis', '6901580', options)
+
+    assert aggregate.files == [FileStamp.of(source)]
+    xr.testing.assert_identical(aggregate.dataset, dataset)
+    assert aggregate.dataset['PRES'].encoding == dataset['PRES'].encoding
+    loaded = aggregate.headers[0]['variables']['PRES']
+    assert loaded['dims'] == ('N_PROF', 'N_LEVELS') and loaded['dtype'] == np.dtype('float32')
+    assert type(loaded['attrs']['valid_min']) is np.float32
+    np.testing.assert_array_equal(loaded['attrs']['resolution'], [0.1, 1.])
+    assert loaded['encoding']['original_shape'] == (2, 2) and np.isnan(loaded['encoding']['_FillValue'])
+    assert aggregate.headers[0]['variables']['DATA_MODE']['attrs']['conventions'] == b'R : real time'
+    assert store.load('coriolis', '6901580', {'layout': 'ragged'}) is None
@@ -0,0 +1,56 @@
+import gzip
+
+import pytest
+
+from pokapok.argo.udal import ARGO_DACS, ArgoBroker
+from pokapok.config import Config
+
+
+INDEX = '''# Title : Metadata directory file of the Argo Global Data Assembly Center
+file,profiler_type,institution,date_update
+coriolis/6901580/6901580_meta.nc,841,IF,20240101000000
+'''
+
+
+def listing(*names: str) -> bytes:
+    links = ''.join(f'<a href="{name}">{name}</a>\n' for name in names)
+    return f'<html><body><pre><a href="../">../</a>\n{links}</pre></body></html>'.encode()
+
+
+@pytest.fixture
+def broker(http_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('pokapok.argo.udal.ARGO_URLS', [http_server.url])
+    http_server.files['/ar_index_global_meta.txt.gz'] = gzip.compress(INDEX.encode())
+    for dac in ARGO_DACS:
+        http_server.files[f'/dac/{dac}/'] = listing()
+    http_server.files['/dac/bodc/'] = listing('3901234/')
+    return ArgoBroker(http_server.url, Config(cache_dir=str(tmp_path), cache_ttl=0, listing_ttl=3600))
+
+
+def test_float_in_index(http_server, broker):
+    assert broker._find_the_dac(f'{http_server.url}/dac', '6901580') == 'coriolis'
+    assert [path for path, _ in http_server.requests] == ['/ar_index_global_meta.txt.gz']
+
+
+def test_float_in_dac_listing(http_server, broker):
+    assert broker._find_the_dac(f'{http_server.url}/dac', '3901234') == 'bodc'
+    n_requests = len(http_server.requests)
+    assert broker._find_the_dac(f'{http_server.url}/dac', '3901234') == 'bodc'
+    assert len(http_server.requests) == n_requests
+
+
+def test_unknown_float(http_server, broker):
+    with pytest.raises(KeyError):
+        broker._find_the_dac(f'{http_server.url}/dac', '1234567')
+    paths = [path for path, _ in http_server.requests]
+    # the index is checked once more, then each DAC listing is fetched once
+    assert paths.count('/ar_index_global_meta.txt.gz') == 2
+    assert sorted(p for p in paths if p.startswith('/dac/')) == sorted(f'/dac/{dac}/' for dac in ARGO_DACS)
+
+    n_requests = len(http_server.requests)
+    with pytest.raises(KeyError):
+        broker._find_the_dac(f'{http_server.url}/dac', '1234567')
+    with pytest.raises(KeyError):
+        broker._find_the_dac(f'{http_server.url}/dac', '7654321')
+    # another unknown float only checks the listings, which have not expired
+    assert len(http_server.requests) == n_requests
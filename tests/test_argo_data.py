@@ -0,0 +1,209 @@
+import multiprocessing
+
+import numpy as np
+import xarray as xr
+
+from pokapok.argo.data import (HANDLE_CACHE, combine_ds, interpolate_levels, interpolate_profiles, ragged_profile,
+                                read_variables, scan_header)
+
+
+def reference(pres, values, levels):
+    """ per-profile interpolation with np.interp, NaN outside of the range """
+    result = np.full((len(pres), len(levels)), np.nan)
+    for i, (p, v) in enumerate(zip(pres, values)):
+        finite = np.isfinite(p)
+        order = np.argsort(p[finite])
+        if order.size:
+            result[i] = np.interp(levels, p[finite][order], v[finite][order], left=np.nan, right=np.nan)
+    return result
+
+
+def profiles(n_prof=20, n_levels=15, seed=0):
+    """ profiles with distinct pressures in random order, padded with NaN
+    after a random number of levels (some profiles are empty) """
+    rng = np.random.default_rng(seed)
+    pres = np.full((n_prof, n_levels), np.nan)
+    temp = np.full((n_prof, n_levels), np.nan)
+    for i in range(n_prof):
+        n = rng.integers(0, n_levels + 1)
+        pres[i, :n] = rng.permutation(rng.choice(np.arange(0., 2000., 5.), n, replace=False))
+        temp[i, :n] = rng.normal(10., 5., n)
+    return pres, temp
+
+
+def test_interpolate_profiles():
+    pres, temp = profiles()
+    levels = [-10., 0., 7.5, 100., 500., 1000., 1995., 2500.]
+
+    np.testing.assert_allclose(interpolate_profiles(pres, temp, levels=levels),
+                               reference(pres, temp, levels))
+
+
+def test_interpolate_profiles_on_samples():
+    pres, temp = profiles(seed=1)
+    # every pressure of the first profile, which is in random order
+    levels = np.sort(pres[0][np.isfinite(pres[0])])
+
+    result = interpolate_profiles(pres, temp, levels=levels)
+
+    np.testing.assert_array_equal(result[0], temp[0][np.argsort(pres[0])][:len(levels)])
+    np.testing.assert_allclose(result, reference(pres, temp, levels))
+
+
+def test_interpolate_profiles_outside_range():
+    pres = np.array([[10., 20., 30., np.nan], [np.nan] * 4, [200., 100., np.nan, np.nan]])
+    temp = np.array([[1., 2., 3., np.nan], [np.nan] * 4, [20., 10., np.nan, np.nan]])
+
+    temp_levels, pres_levels = interpolate_profiles(pres, temp, pres, levels=[5., 10., 25., 30., 150., 250.])
+
+    nan = np.nan
+    np.testing.assert_array_equal(temp_levels, [[nan, 1., 2.5, 3., nan, nan],
+                                                [nan] * 6,
+                                                [nan, nan, nan, nan, 15., nan]])
+    np.testing.assert_array_equal(pres_levels, [[nan, 10., 25., 30., nan, nan],
+                                                [nan] * 6,
+                                                [nan, nan, nan, nan, 150., nan]])
+
+
+def test_interpolate_levels_lazy():
+    pres, temp = profiles(n_prof=30, seed=2)
+    ds = xr.Dataset({
+        'PRES': (('N_PROF', 'N_LEVELS'), pres),
+        'TEMP': (('N_PROF', 'N_LEVELS'), temp),
+        'TEMP_QC': (('N_PROF', 'N_LEVELS'), np.full(pres.shape, b'1')),
+        'JULD': ('N_PROF', np.arange(30.)),
+    })
+    levels = [0., 10., 250., 1000., 1500.]
+
+    result = interpolate_levels(ds.chunk({'N_PROF': 7}), levels)
+
+    assert result['TEMP'].chunks is not None
+    assert dict(result.sizes) == {'N_PROF': 30, 'PRES': len(levels)}
+    assert 'TEMP_QC' not in result
+    result = result.compute()
+    np.testing.assert_allclose(result['TEMP'].values, reference(pres, temp, levels))
+    xr.testing.assert_identical(result, interpolate_levels(ds, levels))
+
+
+def chars(strings, n_chars):
+    return np.array([[list(s.ljust(n_chars).encode()) for s in row] for row in strings], dtype='u1').view('S1')
+
+
+def argo_file(path):
+    """ profiles in modes R, A, D and D ; in the second D profile, TEMP is
+    still in real time, and its parameters are listed in another order
+
+    flags 4 reject the first level of raw TEMP and the last level of every
+    profile, where only the third profile has values """
+    nan = np.nan
+    pres = np.array([[10., 20., 30., nan, nan],
+                     [10., 20., 30., 40., nan],
+                     [10., 20., 30., 40., 50.],
+                     [10., 20., nan, nan, nan]])
+    qc = np.full(pres.shape, b'1')
+    qc[:, -1] = b'4'
+    temp_qc = qc.copy()
+    temp_qc[:, 0] = b'4'
+    ds = xr.Dataset({
+        'DATA_MODE': ('N_PROF', np.array([b'R', b'A', b'D', b'D'])),
+        'STATION_PARAMETERS': (('N_PROF', 'N_PARAM', 'STRING16'),
+                               chars([['PRES', 'TEMP']] * 3 + [['TEMP', 'PRES']], 16)),
+        'PARAMETER_DATA_MODE': (('N_PROF', 'N_PARAM'),
+                                np.array([[b'R', b'R'], [b'A', b'A'], [b'D', b'D'], [b'R', b'D']])),
+        'JULD': ('N_PROF', np.arange(4.)),
+        'PRES': (('N_PROF', 'N_LEVELS'), pres),
+        'PRES_QC': (('N_PROF', 'N_LEVELS'), qc),
+        'TEMP': (('N_PROF', 'N_LEVELS'), pres / 10),
+        'TEMP_QC': (('N_PROF', 'N_LEVELS'), temp_qc),
+        'TEMP_ADJUSTED': (('N_PROF', 'N_LEVELS'), pres / 10 + 100),
+        'TEMP_ADJUSTED_QC': (('N_PROF', 'N_LEVELS'), qc),
+    })
+    ds.to_netcdf(path)
+    return str(path), ds
+
+
+def filtered(path, **filters):
+    names = ['DATA_MODE', 'JULD', 'PRES', 'TEMP', 'TEMP_QC', 'TEMP_ADJUSTED']
+    return scan_header(path, filters), read_variables((path, names, filters))
+
+
+def test_filter_data_mode(tmp_path):
+    path, ds = argo_file(tmp_path / 'profiles.nc')
+
+    header, values = filtered(path, data_mode=['A', 'D'])
+
+    assert header['sizes']['N_PROF'] == 3
+    assert header['sizes']['N_LEVELS'] == 5
+    np.testing.assert_array_equal(values['DATA_MODE'], [b'A', b'D', b'D'])
+    np.testing.assert_array_equal(values['JULD'], [1., 2., 3.])
+    np.testing.assert_array_equal(values['TEMP_ADJUSTED'], ds['TEMP_ADJUSTED'].values[1:])
+
+
+def test_filter_prefer_adjusted(tmp_path):
+    path, ds = argo_file(tmp_path / 'profiles.nc')
+
+    header, values = filtered(path, prefer_adjusted=True)
+
+    assert 'TEMP_ADJUSTED' not in header['variables'] and 'TEMP_ADJUSTED' not in values
+    # real time TEMP in the first and last profiles, by PARAMETER_DATA_MODE
+    expected = np.where([[False], [True], [True], [False]], ds['TEMP_ADJUSTED'], ds['TEMP'])
+    np.testing.assert_array_equal(values['TEMP'], expected)
+    expected = np.where([[False], [True], [True], [False]], ds['TEMP_ADJUSTED_QC'], ds['TEMP_QC'])
+    np.testing.assert_array_equal(values['TEMP_QC'], expected)
+
+
+def test_filter_qc_flags(tmp_path):
+    path, ds = argo_file(tmp_path / 'profiles.nc')
+
+    header, values = filtered(path, qc_flags=[1, 2])
+
+    # the last level is rejected everywhere, and trimmed
+    assert header['sizes'] == dict(ds.sizes, N_LEVELS=4)
+    assert values['PRES'].shape == values['TEMP_QC'].shape == (4, 4)
+    np.testing.assert_array_equal(values['PRES'], ds['PRES'].values[:, :4])
+    expected = ds['TEMP'].values[:, :4].copy()
+    expected[:, 0] = np.nan
+    np.testing.assert_array_equal(values['TEMP'], expected)
+
+
+def test_filter_every_profile(tmp_path):
+    path, _ = argo_file(tmp_path / 'profiles.nc')
+
+    header, values = filtered(path, data_mode='X', qc_flags=[1])
+
+    assert header['sizes']['N_PROF'] == 0
+    assert header['sizes']['N_LEVELS'] == 0
+    assert values['JULD'].shape == (0,)
+    assert values['PRES'].shape == values['TEMP_QC'].shape == (0, 0)
+
+
+def test_ragged_row_sizes(tmp_path):
+    path, ds = argo_file(tmp_path / 'profiles.nc')
+    files = [path, argo_file(tmp_path / 'more.nc')[0]]
+
+    for lazy in (False, True):
+        ragged = combine_ds(files, layout='ragged', lazy=lazy)
+
+        # the levels of each profile up to its last value, in any variable
+        np.testing.assert_array_equal(ragged['ROW_SIZE'], [3, 4, 5, 2] * 2)
+        assert ragged.sizes['N_OBS'] == 28
+        np.testing.assert_array_equal(ragged['PRES'][:14], ds['PRES'].values[np.isfinite(ds['PRES'].values)])
+        np.testing.assert_array_equal(ragged_profile(ragged, 5)['TEMP_QC'], ds['TEMP_QC'].values[1, :4])
+
+    filtered = combine_ds(files, layout='ragged', filters={'qc_flags': [1]})
+    np.testing.assert_array_equal(filtered['ROW_SIZE'], [3, 4, 4, 2] * 2)
+
+
+def is_left_open(path):
+    read_variables((path, ['PRES']))
+    return path in HANDLE_CACHE._handles
+
+
+def test_worker_handles_closed(tmp_path):
+    path, _ = argo_file(tmp_path / 'profiles.nc')
+
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        assert pool.map(is_left_open, [path]) == [False]
+    # the driver keeps the file open for the next read
+    assert is_left_open(path)
+    HANDLE_CACHE.close([path])
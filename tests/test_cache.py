@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+
+import pytest
+import requests
+
+from pokapok.cache import Directory
+
+
+SIZE = 3 << 20
+
+
+def content(size: int = SIZE) -> bytes:
+    return os.urandom(size)
+
+
+def test_resume_after_interrupt(http_server, tmp_path):
+    data = content()
+    http_server.files['/data/file.nc'] = data
+    http_server.truncate['/data/file.nc'] = SIZE // 2
+    url = http_server.url + '/data/file.nc'
+
+    with Directory(tmp_path) as dir:
+        with pytest.raises(requests.exceptions.RequestException):
+            dir.download(url, 'data', mkdir=True)
+        part_size = tmp_path.joinpath('data', 'file.nc.part').stat().st_size
+        assert 0 < part_size < SIZE
+
+        file_path = dir.download(url, 'data', mkdir=True)
+
+    assert file_path.read_bytes() == data
+    first, second = http_server.gets('/data/file.nc')
+    assert 'Range' not in first
+    assert second['Range'] == f'bytes={part_size}-'
+    assert not tmp_path.joinpath('data', 'file.nc.part').exists()
+
+
+def test_restart_on_unsatisfiable_range(http_server, tmp_path):
+    data = content()
+    http_server.files['/data/file.nc'] = data
+    http_server.truncate['/data/file.nc'] = SIZE // 2
+    url = http_server.url + '/data/file.nc'
+
+    with Directory(tmp_path) as dir:
+        with pytest.raises(requests.exceptions.RequestException):
+            dir.download(url, 'data', mkdir=True)
+        http_server.unsatisfiable_ranges = True
+        file_path = dir.download(url, 'data', mkdir=True)
+
+    assert file_path.read_bytes() == data
+    _, resumed, restarted = http_server.gets('/data/file.nc')
+    assert 'Range' in resumed
+    assert 'Range' not in restarted
+
+
+def _download(args: tuple[str, str]) -> bytes:
+    cache_dir, url = args
+    with Directory(cache_dir, ttl=3600) as dir:
+        return dir.download(url, 'data', mkdir=True).read_bytes()
+
+
+def test_single_download_by_concurrent_processes(http_server, tmp_path):
+    data = content()
+    http_server.files['/data/file.nc'] = data
+    # slow enough for every process to ask for the file during the download
+    http_server.delay = 0.5
+    url = http_server.url + '/data/file.nc'
+
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        results = pool.map(_download, [(str(tmp_path), url)] * 8)
+
+    assert all(result == data for result in results)
+    assert len(http_server.gets('/data/file.nc')) == 1
@@ -0,0 +1,21 @@
+import pytest
+
+from pokapok.config import Config
+
+
+def test_close_session():
+    with Config() as config:
+        session = config.session
+    assert config._session is None
+    # a new session is opened when needed again
+    assert config.session is not session
+    config.close()
+
+
+def test_close_distributed_cluster():
+    pytest.importorskip('distributed')
+    with Config(dask_scheduler='distributed', dask_workers=1) as config:
+        client = config.dask_options['scheduler']
+        cluster = client.cluster
+    assert client.status == 'closed'
+    assert cluster.status.name == 'closed'
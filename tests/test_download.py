@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from pokapok.download import DownloadScheduler, RetryPolicy
+
+
+def test_retry_releases_host_slot():
+    scheduler = DownloadScheduler(max_workers=2, max_per_host=1)
+    failed = set()
+    finished = {}
+    lock = threading.Lock()
+
+    def download(url):
+        with lock:
+            if url.endswith('/a') and url not in failed:
+                failed.add(url)
+                raise OSError('connection reset')
+        finished[url] = time.monotonic()
+        return url
+
+    start = time.monotonic()
+    results = scheduler.map(download, ['http://host/a', 'http://host/b'], RetryPolicy(attempts=2, wait=1.))
+
+    assert results == ['http://host/a', 'http://host/b']
+    # b is downloaded while a waits to be retried
+    assert finished['http://host/b'] - start < 0.5
+    assert finished['http://host/a'] - start >= 1.
+
+
+def test_retry_gives_up():
+    scheduler = DownloadScheduler(max_workers=2, max_per_host=1)
+    calls = []
+
+    def download(url):
+        calls.append(url)
+        raise OSError('connection reset')
+
+    policy = RetryPolicy(attempts=3, wait=0.)
+    with pytest.raises(OSError):
+        scheduler.map(download, ['http://host/a'], policy)
+    assert len(calls) == 3
+    assert scheduler.map(download, ['http://host/a'], policy._replace(skip=True)) == [None]
+    # other errors are not retried
+    assert scheduler.map(lambda url: 1 / 0, ['http://host/a'], policy._replace(skip=True)) == [None]
@@ -0,0 +1,116 @@
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy
+import xarray
+
+from pokapok.config import Config
+from pokapok.udal import UDAL
+from pokapok.woa23.types import Decade, SpatialRes, TimeRes, Variable
+
+
+DATA_PATH = 'woa23/DATA/temperature/netcdf/decav/5.00/woa23_decav_t00_5d.nc'
+
+QUERY = {
+    'variable': Variable.Temperature,
+    'decade': Decade.DECADE_decav,
+    'grid': SpatialRes.five_deg,
+    'time_res': TimeRes.Annual,
+}
+
+BOX = {'lon_min': -20., 'lon_max': 10., 'lat_min': 30., 'lat_max': 50.}
+
+
+def woa_file(path) -> xarray.Dataset:
+    """Small WOA23-like file on the 5 degree grid."""
+    lon = numpy.arange(-177.5, 180, 5.)
+    lat = numpy.arange(-87.5, 90, 5.)
+    depth = numpy.array([0., 10., 50., 100.])
+    values = numpy.random.default_rng(0).normal(10, 5, (1, len(depth), len(lat), len(lon))).astype('f4')
+    dataset = xarray.Dataset(
+        {'t_an': (('time', 'depth', 'lat', 'lon'), values)},
+        coords={'time': ('time', [6.], {'units': 'months since 1955-01-01 00:00:00'}),
+                'depth': depth, 'lat': lat, 'lon': lon})
+    dataset.to_netcdf(path)
+    return xarray.open_dataset(path, decode_times=False)
+
+
+def subset_service(source):
+    """Stand-in for the NetCDF Subset Service of a file."""
+    def respond(path: str) -> bytes:
+        query = dict(parse_qsl(urlsplit(path).query))
+        subset = source.sel(lon=slice(float(query['west']), float(query['east'])),
+                            lat=slice(float(query['south']), float(query['north'])))
+        return subset.to_netcdf()
+    return respond
+
+
+def test_subset(http_server, tmp_path):
+    full = woa_file(tmp_path.joinpath('source.nc'))
+    http_server.responders[f'/thredds-ocean/ncss/grid/{DATA_PATH}?'] = subset_service(full)
+    cache_dir = tmp_path.joinpath('cache')
+    cache_dir.mkdir()
+    config = Config(cache_dir=str(cache_dir), woa23_url=http_server.url + '/thredds-ocean')
+
+    result = UDAL(None, config).execute('urn:pokapok:udal:woa23', QUERY | BOX).data()
+    # a new broker does not share the opened datasets of the first one
+    again = UDAL(None, config).execute('urn:pokapok:udal:woa23', QUERY | BOX).data()
+
+    expected = full.sel(lon=slice(BOX['lon_min'], BOX['lon_max']), lat=slice(BOX['lat_min'], BOX['lat_max']))
+    xarray.testing.assert_identical(result.load(), expected.load())
+    xarray.testing.assert_identical(again.load(), result)
+    paths = [path for path, _ in http_server.requests]
+    assert not any(path.startswith('/thredds-ocean/fileServer/') for path in paths)
+    assert len(paths) == 1
+    assert [p.name for p in cache_dir.joinpath('woa23', 'temperature', 'subsets').iterdir()] \
+        == ['woa23_decav_t00_5d_-20_10_30_50.nc']
+
+
+def test_subset_falls_back_to_whole_file(http_server, tmp_path):
+    full = woa_file(tmp_path.joinpath('source.nc'))
+    http_server.files[f'/thredds-ocean/fileServer/{DATA_PATH}'] = tmp_path.joinpath('source.nc').read_bytes()
+    http_server.statuses['/thredds-ocean/ncss/'] = 400
+    cache_dir = tmp_path.joinpath('cache')
+    cache_dir.mkdir()
+
+    udal = UDAL(None, Config(cache_dir=str(cache_dir), woa23_url=http_server.url + '/thredds-ocean'))
+    result = udal.execute('urn:pokapok:udal:woa23', QUERY | BOX).data()
+
+    expected = full.sel(lon=slice(BOX['lon_min'], BOX['lon_max']), lat=slice(BOX['lat_min'], BOX['lat_max']))
+    xarray.testing.assert_identical(result.load(), expected.load())
+    paths = [path for path, _ in http_server.requests]
+    assert any(path.startswith(f'/thredds-ocean/ncss/grid/{DATA_PATH}?') for path in paths)
+    assert f'/thredds-ocean/fileServer/{DATA_PATH}' in paths
+
+
+def test_outdated_zarr_stores_removed(http_server, tmp_path):
+    source = tmp_path.joinpath('source.nc')
+    cache_dir = tmp_path.joinpath('cache')
+    cache_dir.mkdir()
+    config = Config(cache_dir=str(cache_dir), cache_ttl=0, woa23_url=http_server.url + '/thredds-ocean',
+                    woa23_subset=False, woa23_zarr=True)
+    url = f'{config.woa23_url}/fileServer/{DATA_PATH}'
+    store_dir = cache_dir.joinpath('woa23', 'temperature')
+
+    def update(offset):
+        dataset = woa_file(source)
+        http_server.files[f'/thredds-ocean/fileServer/{DATA_PATH}'] = (dataset + offset).to_netcdf()
+
+    def stores():
+        return sorted(path.name for path in store_dir.glob('*.zarr'))
+
+    update(0.)
+    udal = UDAL(None, config)
+    first = udal.execute('urn:pokapok:udal:woa23', QUERY).data()
+    [first_store] = stores()
+
+    # the store of the first version is kept while its dataset is cached
+    update(1.)
+    udal._broker._open_woa(url, DATA_PATH, 'woa23/temperature')
+    assert len(stores()) == 2 and first_store in stores()
+    first = first.load()
+
+    update(2.)
+    again = UDAL(None, config).execute('urn:pokapok:udal:woa23', QUERY).data()
+    [last_store] = stores()
+    assert last_store != first_store
+    numpy.testing.assert_allclose(again['t_an'].values, first['t_an'].values + 2.)